@@ -1,39 +1,1050 @@
 import os
+import sys
 import time
 import subprocess
 import logging
 import threading
-import tkinter as tk
-from tkinter import filedialog, messagebox, scrolledtext, ttk
-import paramiko
+import argparse
+import signal
+import contextlib
+import shlex
 from datetime import datetime
 import re
 import shutil
+import json
+import queue
+import hashlib
+import heapq
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import deque
+import select
+import struct
+import ctypes
+import ctypes.util
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+# Tk modules, imported on first use so headless runs never load them (see _load_gui)
+tk = ttk = filedialog = messagebox = scrolledtext = None
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+MANIFEST_VERSION = 1
+# Written to the mirror's .gitignore; also what the source walk prunes by default
+DEFAULT_IGNORE_PATTERNS = (
+    '.*',
+    '!.gitignore',
+    '!.github/',
+    '.DS_Store',
+    'Thumbs.db',
+    '*.swp',
+    '*.bak',
+    '*.tmp',
+    '.env',
+    'node_modules/',
+    '__pycache__/',
+    '*.pyc',
+)
+COPY_MODES = ('copy', 'reflink', 'hardlink')
+FICLONE = 0x40049409  # ioctl request for reflink clones on Linux (btrfs, XFS, ...)
+# Large-file mode: chunks live in the mirror under CHUNK_DIR, named by their SHA-256
+CHUNK_DIR = '.gms-chunks'
+CHUNK_POINTER_MAGIC = 'gms-chunked 1'
+CHUNK_MIN_SIZE = 256 * 1024
+CHUNK_AVG_BITS = 20  # Boundaries every 1 MiB on average
+CHUNK_MAX_SIZE = 4 * 1024 * 1024
+# Repository maintenance runs once the mirror holds this many loose objects (estimated the
+# way gc --auto does) or packs, and at most once per MAINTENANCE_INTERVAL seconds
+MAINTENANCE_LOOSE_OBJECTS = 2000
+MAINTENANCE_PACK_LIMIT = 16
+MAINTENANCE_INTERVAL = 3600
+# Files that vanished or appeared during a sync, held back to be paired up as moves; any
+# beyond this are deleted or copied straight away, so memory stays bounded on large changes
+MOVE_DETECTION_LIMIT = 10000
+# Gear table for the rolling hash; derived from SHA-256 so chunk boundaries never change between versions
+_GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], 'big') for i in range(256)]
+
+
+class SyncManifest:
+    """On-disk index of the files mirrored by the last successful sync.
+
+    Each line maps a relative path to ``[size, mtime_ns, inode, hash]`` of the
+    source file at the time it was copied, so unchanged files can be skipped
+    without touching the destination tree at all. Lines are kept in path order
+    so the manifest can be streamed alongside a sorted tree walk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.loaded = False
+
+    def load(self):
+        """Check that a manifest of the current version exists; entries are streamed by iterating."""
+        self.loaded = False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+            self.loaded = header.get('version') == MANIFEST_VERSION
+        except (OSError, ValueError, AttributeError):
+            pass
+        return self.loaded
+
+    def __iter__(self):
+        """Yield ``(rel_path, record)`` in path order, skipping damaged or misordered lines."""
+        if not self.loaded:
+            return
+        last = None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                f.readline()  # Header, checked by load()
+                for line in f:
+                    try:
+                        rel_path, size, mtime_ns, inode, digest = json.loads(line)
+                    except (ValueError, TypeError):
+                        continue
+                    if last is not None and rel_path <= last:
+                        continue
+                    last = rel_path
+                    yield rel_path, (size, mtime_ns, inode, digest)
+        except FileNotFoundError:
+            pass
+
+    def count(self):
+        """Number of entries, counted without keeping them."""
+        return sum(1 for _ in self)
+
+    def writer(self):
+        """Start writing a replacement manifest; entries must be written in path order."""
+        return ManifestWriter(self.path)
+
+    def invalidate(self):
+        """Drop the manifest so the next sync re-checks the destination tree."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.loaded = False
+
+
+class ManifestWriter:
+    """Streams manifest entries into a temporary file that commit() swaps in atomically.
+
+    After defer(), entries may arrive in any order; they are held back and merged
+    into the streamed ones by commit().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.last = None
+        self.deferred = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(self.tmp_path, 'w', encoding='utf-8')
+        self.file.write(json.dumps({'version': MANIFEST_VERSION}) + '\n')
+
+    def write(self, rel_path, record):
+        if self.deferred is not None:
+            self.deferred.append((rel_path, record))
+            return
+        if self.last is not None and rel_path <= self.last:
+            raise ValueError(f"Manifest entries out of order: {rel_path!r} after {self.last!r}")
+        self.last = rel_path
+        self.file.write(json.dumps([rel_path, *record]) + '\n')
+
+    def defer(self):
+        """Hold back further entries until commit(), for results settled after the walk."""
+        if self.deferred is None:
+            self.deferred = []
+
+    def _merge_deferred(self):
+        self.file.close()
+        merged_path = self.tmp_path + '.merge'
+
+        def streamed(f):
+            for line in f:
+                rel_path, *record = json.loads(line)
+                yield rel_path, record
+
+        with open(self.tmp_path, 'r', encoding='utf-8') as src, \
+                open(merged_path, 'w', encoding='utf-8') as dst:
+            dst.write(src.readline())  # Header
+            for rel_path, record, late in merge_sorted(streamed(src), sorted(self.deferred)):
+                dst.write(json.dumps([rel_path, *(late if late is not None else record)]) + '\n')
+        os.replace(merged_path, self.tmp_path)
+        self.file = open(self.tmp_path, 'a', encoding='utf-8')
+        self.deferred = None
+
+    def commit(self):
+        if self.deferred:
+            self._merge_deferred()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class SyncJournal:
+    """Write-ahead log of a sync in progress.
+
+    Holds ``plan``, ``done`` and ``deleted`` lines, in path order within each ``run``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def open(self):
+        """Start a new journal; line buffered so a killed process loses at most the line being written."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, 'w', encoding='utf-8', buffering=1)
+        return self
+
+    def start_run(self):
+        """Begin a new path-ordered run of completions."""
+        self.file.write(json.dumps(['run', None]) + '\n')
+
+    def planned(self, rel_path):
+        self.file.write(json.dumps(['plan', rel_path]) + '\n')
+
+    def done(self, rel_path, record):
+        self.file.write(json.dumps(['done', rel_path, *record]) + '\n')
+
+    def deleted(self, rel_path):
+        self.file.write(json.dumps(['deleted', rel_path]) + '\n')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def entries(self):
+        """Yield ``(op, rel_path, record or None)`` in the order written, skipping a torn last line."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        op, rel_path, *record = json.loads(line)
+                    except (ValueError, TypeError):
+                        continue
+                    yield op, rel_path, tuple(record) if op == 'done' else None
+        except FileNotFoundError:
+            pass
+
+    def completed(self):
+        """Yield ``(rel_path, (op, record))`` for finished operations, in path order."""
+        runs = 1 + sum(op == 'run' for op, _, _ in self.entries())
+        last = None
+        for rel_path, change in heapq.merge(*(self._completed_run(run) for run in range(runs)),
+                                            key=lambda item: item[0]):
+            if last is None or rel_path != last:
+                last = rel_path
+                yield rel_path, change
+
+    def _completed_run(self, run):
+        """Finished operations of one run, reading the journal again rather than holding it."""
+        current = 0
+        last = None
+        for op, rel_path, record in self.entries():
+            if op == 'run':
+                current += 1
+                last = None
+            elif current == run and op != 'plan' and (last is None or rel_path > last):
+                last = rel_path
+                yield rel_path, (op, record)
+
+
+class ChangeHistogram:
+    """Approximate top-N of changed files per directory in bounded memory.
+
+    Uses the Space-Saving algorithm: at most capacity directories are tracked,
+    and a new one evicts the smallest count (inheriting it, so counts are upper
+    bounds). Exact while a backup touches no more than capacity directories.
+    """
+
+    def __init__(self, capacity=64, depth=2):
+        self.capacity = capacity
+        self.depth = depth  # Directories are rolled up to this many path components
+        self.counts = {}
+
+    def add(self, rel_path):
+        parts = os.path.dirname(rel_path).split(os.sep)[:self.depth]
+        key = '/'.join(parts) or '.'
+        if key in self.counts:
+            self.counts[key] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = 1
+        else:
+            smallest = min(self.counts, key=self.counts.get)
+            self.counts[key] = self.counts.pop(smallest) + 1
+
+    def top(self, n=5):
+        return sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+
+def format_size(size):
+    """Human-readable byte count."""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def merge_sorted(left, right):
+    """Merge-join two streams of ``(key, value)`` pairs that are both sorted by key.
+
+    Yields ``(key, left_value, right_value)``, with None on the side lacking the key.
+    """
+    left, right = iter(left), iter(right)
+    a, b = next(left, None), next(right, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and a[0] < b[0]):
+            yield a[0], a[1], None
+            a = next(left, None)
+        elif a is None or b[0] < a[0]:
+            yield b[0], None, b[1]
+            b = next(right, None)
+        else:
+            yield a[0], a[1], b[1]
+            a, b = next(left, None), next(right, None)
+
+
+def git_blob_sha1(path, size):
+    """Hash a file the way ``git hash-object`` does, so the digest doubles as its blob id."""
+    digest = hashlib.sha1(b'blob %d\0' % size)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def temp_sibling(path, tag):
+    """Hidden name next to path for writing it before an atomic rename; matched by the '.*' ignore rule."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f'.{name}.gms-{tag}')
+
+
+def clone_file(src, dst):
+    """Copy src to dst as cheaply as the filesystem allows and return the method used.
+
+    Tries a reflink clone first, then an in-kernel copy_file_range, and finally
+    shutil.copyfile (which itself uses sendfile on Linux). Metadata is copied
+    like shutil.copy2.
+    """
+    method = _clone_contents(src, dst)
+    shutil.copystat(src, dst)
+    return method
+
+
+def _clone_contents(src, dst):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return 'reflink'
+            except OSError:
+                pass  # Filesystem does not support clones
+
+        if hasattr(os, 'copy_file_range'):
+            size = os.fstat(fsrc.fileno()).st_size
+            offset = 0
+            try:
+                while offset < size:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+                    if copied == 0:
+                        break
+                    offset += copied
+                return 'copy_file_range'
+            except OSError:
+                fdst.truncate(0)  # E.g. cross-device on older kernels, start over below
+
+    shutil.copyfile(src, dst)
+    return 'sendfile'
+
+
+def content_chunks(path, min_size=CHUNK_MIN_SIZE, avg_bits=CHUNK_AVG_BITS, max_size=CHUNK_MAX_SIZE):
+    """Yield the contents of path cut at content-defined boundaries.
+
+    Uses a gear rolling hash (as in FastCDC), so an edit only changes the chunks
+    around it and the rest of the file keeps its boundaries and chunk ids.
+    """
+    limit = 1 << (32 - avg_bits)  # Cut where the high avg_bits bits (the last 32 bytes) are clear
+    with open(path, 'rb') as f:
+        buf = b''
+        while True:
+            data = f.read(max_size)
+            buf += data
+            while len(buf) >= max_size or (buf and not data):
+                cut = _chunk_boundary(buf, min_size, max_size, limit)
+                yield buf[:cut]
+                buf = buf[cut:]
+            if not data:
+                return
+
+
+def _chunk_boundary(buf, min_size, max_size, limit):
+    end = min(len(buf), max_size)
+    if end <= min_size:
+        return end
+    gear = _GEAR
+    h = 0
+    i = min_size
+    for byte in memoryview(buf)[min_size:end]:
+        h = (h + h + gear[byte]) & 0xFFFFFFFF
+        i += 1
+        if h < limit:
+            return i
+    return end
+
+
+def chunk_lengths(path):
+    """Lengths of the chunks content_chunks cuts path into; run in a worker process.
+
+    The rolling hash is a per-byte Python loop (a few MB/s) holding the GIL, so
+    it is kept away from the copy threads.
+    """
+    return [len(data) for data in content_chunks(path)]
+
+
+def read_chunk_pointer(path):
+    """Parse a chunk pointer file; None if path holds ordinary content."""
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(CHUNK_POINTER_MAGIC) + 1) != CHUNK_POINTER_MAGIC.encode() + b'\n':
+                return None
+            lines = f.read().decode('ascii').splitlines()
+        size = int(lines[0].split()[1])
+        digest = lines[1].split()[1]
+        chunks = [(chunk_id, int(length)) for chunk_id, length in (line.split() for line in lines[2:])]
+    except (OSError, ValueError, IndexError, UnicodeDecodeError):
+        return None
+    return size, digest, chunks
+
+
+def restore_chunked(pointer_path, chunk_root, output_path):
+    """Reassemble the file described by a chunk pointer and verify its checksum."""
+    pointer = read_chunk_pointer(pointer_path)
+    if pointer is None:
+        raise ValueError(f"Not a chunk pointer: {pointer_path}")
+    size, expected, chunks = pointer
+    digest = hashlib.sha256()
+    written = 0
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        for chunk_id, length in chunks:
+            with open(os.path.join(chunk_root, chunk_id[:2], chunk_id), 'rb') as f:
+                data = f.read()
+            if len(data) != length:
+                raise ValueError(f"Chunk {chunk_id} is truncated")
+            digest.update(data)
+            written += out.write(data)
+    if written != size or digest.hexdigest() != expected:
+        os.remove(tmp_path)
+        raise ValueError(f"Checksum mismatch restoring {pointer_path}")
+    os.replace(tmp_path, output_path)
+
+
+def write_json_atomic(path, data):
+    """Write data as JSON to path via a temporary file and rename."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_ref(git_dir, ref):
+    """Resolve a ref from loose or packed refs; '' for an unborn branch."""
+    try:
+        with open(os.path.join(git_dir, ref), 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    try:
+        with open(os.path.join(git_dir, 'packed-refs'), 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.rstrip('\n').endswith(' ' + ref):
+                    return line.split(' ', 1)[0]
+    except FileNotFoundError:
+        pass
+    return ''
+
+
+def parse_status_v2(output):
+    """Parse ``git status --porcelain=v2 -z`` output into ``(XY, path)`` pairs."""
+    entries = []
+    records = iter(output.split('\0'))
+    for record in records:
+        if not record:
+            continue
+        kind = record[0]
+        if kind == '1':
+            fields = record.split(' ', 8)
+            entries.append((fields[1], fields[8]))
+        elif kind == '2':
+            fields = record.split(' ', 9)
+            entries.append((fields[1], fields[9]))
+            next(records, None)  # Original path of the rename/copy
+        elif kind == 'u':
+            fields = record.split(' ', 10)
+            entries.append((fields[1], fields[10]))
+        elif kind in '?!':
+            entries.append((kind * 2, record[2:]))
+    return entries
+
+
+def parse_gitmodules(path):
+    """Map each submodule path in a .gitmodules file to ``(name, url)``; {} if there is none."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    except (OSError, UnicodeDecodeError):
+        return {}
+    sections = {}
+    name = None
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] in '#;':
+            continue
+        header = re.match(r'\[submodule\s+"(.*)"\]$', line)
+        if header:
+            name = header.group(1)
+            sections[name] = {}
+        elif name is not None and '=' in line:
+            key, _, value = line.partition('=')
+            sections[name][key.strip().lower()] = value.strip().strip('"')
+    return {values['path'].replace('/', os.sep): (name, values.get('url'))
+            for name, values in sections.items() if values.get('path')}
+
+
+def _glob_to_regex(pattern):
+    """Translate one gitignore glob into a regex over '/'-separated paths."""
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            body = pattern[i + 1:end]
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            regex += '[' + body.replace('\\', '\\\\') + ']'
+            i = end + 1
+        elif pattern[i] == '\\' and i + 1 < len(pattern):
+            regex += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return regex
+
+
+class IgnoreRules:
+    """The root .gitignore plus extra excludes, compiled for pruning walks; files in keep are never ignored."""
+
+    def __init__(self, patterns, keep=()):
+        self.rules = []
+        for line in patterns:
+            line = line.rstrip('\n')
+            if not line.endswith('\\ '):
+                line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            anchored = '/' in line
+            regex = _glob_to_regex(line.lstrip('/'))
+            if not anchored:
+                regex = '(?:.*/)?' + regex
+            self.rules.append((re.compile(regex + r'\Z', re.DOTALL), negate, dir_only))
+
+        self.keep = frozenset(keep)
+        self.keep_dirs = set()
+        for rel_path in self.keep:
+            parent = os.path.dirname(rel_path)
+            while parent and parent not in self.keep_dirs:
+                self.keep_dirs.add(parent)
+                parent = os.path.dirname(parent)
+        # Ignored directories only entered for the tracked files below them
+        self.kept_ignored_dirs = {rel_path for rel_path in self.keep_dirs if self._match(rel_path, True)}
+
+    @classmethod
+    def from_file(cls, path, extra=(), keep=()):
+        """Rules from a .gitignore file (missing is fine) followed by extra patterns."""
+        try:
+            with open(path, 'r', encoding='utf-8', errors='surrogateescape') as f:
+                patterns = f.read().splitlines()
+        except FileNotFoundError:
+            patterns = list(DEFAULT_IGNORE_PATTERNS)
+        return cls(patterns + list(extra), keep)
+
+    def matches(self, rel_path, is_dir):
+        """Whether rel_path itself is ignored (its parents are assumed not to be)."""
+        if self.keep:
+            if rel_path in (self.keep_dirs if is_dir else self.keep):
+                return False
+            if self.kept_ignored_dirs:
+                parent = os.path.dirname(rel_path)
+                while parent:
+                    if parent in self.kept_ignored_dirs:
+                        return True  # Everything else in there stays ignored
+                    parent = os.path.dirname(parent)
+        return self._match(rel_path, is_dir)
+
+    def _match(self, rel_path, is_dir):
+        if os.sep != '/':
+            rel_path = rel_path.replace(os.sep, '/')
+        for regex, negate, dir_only in reversed(self.rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                return not negate
+        return False
+
+    def excluded(self, rel_path, is_dir):
+        """Whether rel_path or any directory above it is ignored."""
+        parent = os.path.dirname(rel_path)
+        while parent:
+            if self.matches(parent, True):
+                return True
+            parent = os.path.dirname(parent)
+        return self.matches(rel_path, is_dir)
+
+
+def _listing(root, rel_dir):
+    """Entries of one directory sorted so a depth-first walk yields paths in string order."""
+    with os.scandir(os.path.join(root, rel_dir)) as it:
+        entries = [(os.path.join(rel_dir, entry.name) if rel_dir else entry.name,
+                    entry, entry.is_dir(follow_symlinks=False)) for entry in it]
+    # A directory sorts as 'name/', which is where its children fall among the full paths
+    entries.sort(key=lambda item: item[0] + os.sep if item[2] else item[0])
+    return iter(entries)
+
+
+def scan_tree(root, ignore=None, start=''):
+    """Yield ``(rel_path, DirEntry)`` for every file below root, in sorted path order.
+
+    Ignored directories are pruned before descending, so nothing inside them is
+    ever stat'ed. Only one listing per directory level is held at a time. start
+    optionally names a subdirectory (relative to root) to walk.
+    """
+    stack = [_listing(root, start)]
+    while stack:
+        for rel_path, entry, is_dir in stack[-1]:
+            if is_dir:
+                if ignore is None or not ignore.matches(rel_path, True):
+                    stack.append(_listing(root, rel_path))
+                    break
+            elif not entry.is_dir():
+                if ignore is None or not ignore.matches(rel_path, False):
+                    yield rel_path, entry
+        else:
+            stack.pop()
+
+
+class _FileEntry:
+    """Stand-in for os.DirEntry when a single path is already known."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def stat(self):
+        return os.stat(self.path)
+
+
+class TreeWatcher:
+    """Collects paths changed below a root directory; subclasses supply the events."""
+
+    kind = 'none'
+
+    def __init__(self, root, ignore=None):
+        self.root = root
+        self.ignore = ignore
+
+    def poll(self, timeout):
+        """Return changed relative paths seen within timeout, or None if a rescan is needed."""
+        raise NotImplementedError
+
+    def wait_for_changes(self, debounce, stop_event, max_delay=None):
+        """Block until a burst of changes settles for debounce seconds.
+
+        Returns the dirty relative paths, None when everything must be rescanned,
+        or an empty set if stop_event was set first.
+        """
+        max_delay = max_delay if max_delay is not None else debounce * 10
+        dirty = set()
+        first_event = None
+        while not stop_event.is_set():
+            changes = self.poll(debounce if first_event else 1.0)
+            if changes is None:
+                return None
+            if changes:
+                dirty |= changes
+                first_event = first_event or time.monotonic()
+                # Keep absorbing the burst, but never delay a backup indefinitely
+                if time.monotonic() - first_event < max_delay:
+                    continue
+            if first_event:
+                return dirty
+        return set()
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(TreeWatcher):
+    """Portable fallback that compares periodic snapshots of the tree."""
+
+    kind = 'polling'
+
+    def __init__(self, root, interval=2.0, ignore=None):
+        super().__init__(root, ignore)
+        self.interval = interval
+        self.snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for rel_path, entry in scan_tree(self.root, self.ignore):
+            try:
+                st = entry.stat()
+                snapshot[rel_path] = (st.st_size, st.st_mtime_ns, st.st_ino)
+            except OSError:
+                pass
+        return snapshot
+
+    def poll(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        snapshot = self._take_snapshot()
+        changes = {rel_path for rel_path, sig in snapshot.items() if self.snapshot.get(rel_path) != sig}
+        changes.update(rel_path for rel_path in self.snapshot if rel_path not in snapshot)
+        self.snapshot = snapshot
+        return changes
+
+
+class InotifyWatcher(TreeWatcher):
+    """Linux watcher built on inotify through ctypes, one watch per directory."""
+
+    kind = 'inotify'
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, root, ignore=None):
+        super().__init__(root, ignore)
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        try:
+            self._watch_tree('')
+        except OSError:
+            self.close()
+            raise
+
+    def _watch_tree(self, rel_dir):
+        """Add watches for rel_dir and everything below it."""
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            path = os.path.join(self.root, current) if current else self.root
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                if not os.path.isdir(path):
+                    continue  # Vanished while we were walking it
+                raise OSError(errno, f"inotify_add_watch failed for {path}")
+            self.watches[wd] = current
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            rel_path = os.path.join(current, entry.name) if current else entry.name
+                            if self.ignore is None or not self.ignore.matches(rel_path, True):
+                                stack.append(rel_path)
+            except OSError:
+                pass
+
+    def poll(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changes = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                return None  # Events were dropped, only a full rescan is safe
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            rel_dir = self.watches.get(wd)
+            if rel_dir is None or not name:
+                continue
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            if self.ignore is not None and self.ignore.matches(rel_path, bool(mask & self.IN_ISDIR)):
+                continue
+            changes.add(rel_path)
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                try:
+                    self._watch_tree(rel_path)
+                except OSError:
+                    return None  # Out of watches; let the caller rescan
+        return changes
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def create_watcher(root, poll_interval=2.0, ignore=None):
+    """Use inotify where available and fall back to polling."""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root, ignore)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(root, poll_interval, ignore)
+
+
+class BackupReport:
+    """Per-phase timings and counters of one backup() run.
+
+    Phases accumulate wall time; 'copy' is summed over the copy workers. Git
+    subprocesses are counted against the phase they ran in.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.duration = None
+        self.ok = None
+        self.fast_path = False
+        self.phases = {}  # name -> [seconds, git calls]
+        self.counters = {'files_scanned': 0, 'files_examined': 0, 'bytes_copied': 0, 'git_calls': 0}
+        self.current = None
+        self._clock = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Charge the wall time of the block (and git calls made in it) to a phase."""
+        outer, self.current = self.current, name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+            self.current = outer
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.phases.setdefault(name, [0.0, 0])[0] += seconds
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def git_call(self, phase, seconds):
+        """Record one git subprocess, timed into phase if given (else the current span)."""
+        with self._lock:
+            self.counters['git_calls'] += 1
+            name = phase or self.current
+            if name is not None:
+                entry = self.phases.setdefault(name, [0.0, 0])
+                entry[1] += 1
+                if phase is not None:
+                    entry[0] += seconds
+
+    def finish(self, ok, fast_path):
+        self.ok = ok
+        self.fast_path = fast_path
+        self.duration = time.perf_counter() - self._clock
+
+    def to_dict(self):
+        return {
+            'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'ok': self.ok,
+            'fast_path': self.fast_path,
+            'duration': round(self.duration or 0.0, 6),
+            **self.counters,
+            'phases': {name: {'seconds': round(seconds, 6), 'git_calls': calls}
+                       for name, (seconds, calls) in self.phases.items()},
+        }
+
+    def prometheus(self, repo):
+        """The report in the Prometheus text exposition format, labelled with repo."""
+        label = repo.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append(f"# HELP gms_backup_{name} {help_text}")
+            lines.append(f"# TYPE gms_backup_{name} gauge")
+            for extra, value in samples:
+                lines.append(f'gms_backup_{name}{{repo="{label}"{extra}}} {value}')
+
+        metric('last_run_timestamp_seconds', "Start of the last backup run.", [('', f"{self.started:.3f}")])
+        metric('success', "Whether the last backup run succeeded.", [('', int(bool(self.ok)))])
+        metric('fast_path', "Whether the last run was skipped without running git.", [('', int(self.fast_path))])
+        metric('duration_seconds', "Wall time of the last backup run.", [('', f"{self.duration or 0.0:.6f}")])
+        for name, value in self.counters.items():
+            metric(name, f"{name.replace('_', ' ').capitalize()} in the last backup run.", [('', value)])
+        metric('phase_seconds', "Time spent per phase of the last backup run.",
+               [(f',phase="{name}"', f"{seconds:.6f}") for name, (seconds, _) in sorted(self.phases.items())])
+        metric('phase_git_calls', "Git subprocesses per phase of the last backup run.",
+               [(f',phase="{name}"', calls) for name, (_, calls) in sorted(self.phases.items())])
+        return '\n'.join(lines) + '\n'
+
 
 class SSHGitBackup:
-    def __init__(self, notes_path, repo_url, ssh_key_path=None, branch='main', username=None, password=None):
+    def __init__(self, notes_path, repo_url, ssh_key_path=None, branch='main', username=None, password=None,
+                 content_hash=False, copy_workers=8, copy_mode='copy', direct_staging=False,
+                 confirm_force_push=None, ssh_multiplex=True, ssh_persist=600, mirror_dir=None,
+                 exclude=None, chunk_threshold=None, report_log=None, metrics_file=None, submodules=None,
+                 partial_clone=True, push_interval=None, push_commits=None, push_bytes=None,
+                 performance_profile=True):
                self.notes_path = os.path.abspath(notes_path)
                self.repo_url = repo_url
                self.branch = branch
                self.repo_name = self._extract_repo_name(repo_url)
+               # Mirror repository; defaults to ~/<repo_name>, give each concurrent job its own
+               self.repo_path = os.path.abspath(mirror_dir) if mirror_dir else \
+                   os.path.join(os.path.expanduser('~'), self.repo_name)
                self.ssh_key_path = ssh_key_path
                self.username = username
                self.password = password
                self.is_ssh = self._is_ssh_url(repo_url)
-               self.backup_status = {}
+               self._reset_counts()
+               # Environment for git (SSH command etc.) and timings of the git calls of the last run
+               self.git_env = None
+               self.git_calls = []
+               self.fast_path_taken = False
+               # Timings of the last run; optionally appended to report_log (JSON lines) and
+               # written to metrics_file for the Prometheus node_exporter textfile collector
+               self.report = BackupReport()
+               # Size of the tree at the last full run, so a progress bar knows what to expect
+               self.expected_files = None
+               self.report_log = report_log
+               self.metrics_file = metrics_file
+               # Compare file contents (git blob ids) instead of mtime/size alone
+               self.content_hash = content_hash
+               # Number of threads copying changed files into the mirror
+               self.copy_workers = max(1, copy_workers)
+               # 'copy' (shutil.copy2), 'reflink' (clone, falling back to in-kernel copies)
+               # or 'hardlink' (share inodes with read-only sources)
+               if copy_mode not in COPY_MODES:
+                   raise ValueError(f"Unknown copy mode: {copy_mode}")
+               self.copy_mode = copy_mode
+               # Stage from notes_path using the mirror only as GIT_DIR, skipping the copy
+               self.direct_staging = direct_staging
+               # Callback asked before a force push; without one, failed pushes are simply retried
+               self.confirm_force_push = confirm_force_push
+               # Files of at least this many bytes are committed as deduplicated chunks plus a pointer
+               if chunk_threshold and direct_staging:
+                   logging.getLogger(__name__).warning("Large-file chunking needs the mirror, "
+                                                       "ignored in direct staging mode")
+                   chunk_threshold = None
+               self.chunk_threshold = chunk_threshold
+               # Worker processes that find chunk boundaries, started by the first chunked file of a sync
+               self._chunk_pool = None
+               self._chunk_pool_lock = threading.Lock()
+               # Nested repositories (paths below notes_path) to register as submodules, on top
+               # of any listed in notes_path/.gitmodules
+               self.submodules = list(submodules or [])
+               self._gitmodules_cache = None
+               # Submodules whose commit failed last time, retried until they are clean
+               self.dirty_submodules = set()
+               # Push policy: commit every run, but push only once the oldest unpushed commit is
+               # push_interval seconds old, or push_commits commits / push_bytes bytes are pending.
+               # With none set, every commit is pushed right away.
+               self.push_interval = push_interval
+               self.push_commits = push_commits
+               self.push_bytes = push_bytes
+               # Unpushed commits ({'commits', 'bytes', 'since'}), kept in state.json between runs
+               self.pending_push = {}
+               # Turn on index v4, split index and fsmonitor in the mirror
+               # where they work (see _apply_performance_profile)
+               self.performance_profile = performance_profile
+               # Start new mirrors from the remote's history without downloading file contents
+               self.partial_clone = partial_clone
+               # Share one SSH connection across fetch/merge/push (and across runs for ssh_persist seconds)
+               self.ssh_multiplex = ssh_multiplex
+               self.ssh_persist = ssh_persist
 
                logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s: %(message)s')
                self.logger = logging.getLogger(__name__)
-
-               # Set up git credentials right after initialization
-               if not self.is_ssh and self.username and self.password:
-                   self._setup_https_credentials()
+               # Extra gitignore-style patterns never walked, copied or staged
+               self.exclude = list(exclude or [])
+               self._ignore_cache = None
+               # Per-job credential store for HTTPS, written for the duration of each backup
+               self.credentials_file = None
+               # Semaphore shared by jobs talking to the same remote host (see BackupScheduler)
+               self.remote_slot = None
 
     def _setup_https_credentials(self):
-            """Setup HTTPS credentials using Git credential helper."""
+            """Setup HTTPS credentials in a credential store private to this backup."""
             try:
-                # Create the credentials file
-                credentials_file = os.path.expanduser('~/.git-credentials')
+                # One file per mirror so concurrent jobs never overwrite each other
+                path_hash = hashlib.sha1(self.repo_path.encode('utf-8')).hexdigest()[:12]
+                credentials_file = os.path.expanduser(f'~/.git-credentials-backup-{path_hash}')
 
                 # Format the URL with credentials
                 parsed_url = self.repo_url.rstrip('/')
@@ -42,12 +1053,13 @@ class SSHGitBackup:
 
                 credential_url = parsed_url.replace('https://', f'https://{self.username}:{self.password}@')
 
-                # Write credentials to file
-                with open(credentials_file, 'w') as f:
+                # Write credentials to file, readable only by us
+                fd = os.open(credentials_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, 'w') as f:
                     f.write(credential_url + '\n')
 
-                # Configure Git to use the credential store
-                subprocess.run(['git', 'config', '--global', 'credential.helper', 'store'], check=True)
+                # Our git calls point the credential helper at it with -c (see _git)
+                self.credentials_file = credentials_file
 
                 self.logger.info("HTTPS credentials configured successfully")
                 return True
@@ -70,24 +1082,6 @@ class SSHGitBackup:
                 self.logger.error(f"Failed to extract repo name from URL: {e}")
                 return "backup_repository"
 
-    def setup_git_config(self):
-            """Setup git configuration based on authentication method."""
-            try:
-                if self.is_ssh and self.ssh_key_path:
-                    # SSH configuration
-                    ssh_command = f"ssh -i {self.ssh_key_path} -o StrictHostKeyChecking=no"
-                    subprocess.run(['git', 'config', '--global', 'core.sshCommand', ssh_command], check=True)
-                elif not self.is_ssh and self.username and self.password:
-                    # HTTPS configuration - reuse existing credentials
-                    pass  # Credentials are already set up in __init__
-
-                subprocess.run(['git', 'config', '--global', 'pull.rebase', 'false'], check=True)
-                self.logger.info("Git configuration updated successfully")
-                return True
-            except subprocess.CalledProcessError as e:
-                self.logger.error(f"Git config failed: {e}")
-                return False
-
     def _find_default_ssh_key(self):
         """Find default SSH key with expanded key types."""
         key_types = ['id_rsa', 'id_ed25519', 'id_ecdsa', 'id_dsa']
@@ -98,103 +1092,185 @@ class SSHGitBackup:
         return None
 
     def _test_ssh_connection(self):
-        """Test SSH connection with improved error handling."""
+        """Test SSH connection, reusing the multiplexed master when there is one."""
         try:
-            if self.ssh_key_path.endswith('.pub'):
+            if self.ssh_key_path and self.ssh_key_path.endswith('.pub'):
                 raise ValueError("Cannot use public key for SSH authentication")
 
-            key = paramiko.RSAKey.from_private_key_file(self.ssh_key_path)
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            client.connect('github.com', username='git', pkey=key, timeout=10)
-            client.close()
+            if self._ensure_ssh_master():
+                return True
+
+            # No master (multiplexing off or unsupported): ask the remote directly
+            env = dict(os.environ, GIT_SSH_COMMAND=shlex.join(['ssh', *self._ssh_options()]))
+            result = subprocess.run(['git', 'ls-remote', '--heads', self.repo_url, self.branch],
+                                    env=env, capture_output=True, text=True, timeout=30)
+            if result.returncode != 0:
+                self.logger.error(f"SSH Authentication failed: {result.stderr.strip()}")
+                return False
             return True
-        except paramiko.SSHException as e:
-            self.logger.error(f"SSH Authentication failed: {e}")
-            return False
         except Exception as e:
             self.logger.error(f"SSH Connection Test Failed: {e}")
             return False
 
-    def init_repository(self):
-        """Initialize repository with improved setup and source folder handling."""
+    def _ssh_target(self):
+        """Split the SSH remote into (user@host, port); port is '' when not given."""
+        url = self.repo_url
+        if url.startswith('ssh://'):
+            authority = url[len('ssh://'):].split('/', 1)[0]
+            if ':' in authority:
+                host, _, port = authority.rpartition(':')
+                return host, port
+            return authority, ''
+        return url.split(':', 1)[0], ''
+
+    def _ssh_options(self):
+        """Options shared by every ssh invocation for this remote."""
+        options = []
+        if self.ssh_key_path:
+            options += ['-i', self.ssh_key_path]
+        options += ['-o', 'StrictHostKeyChecking=no']
+        return options
+
+    def _control_path(self):
+        """Socket of the multiplexed master; %C keeps it short and unique per host/user/port."""
+        return os.path.join(os.path.expanduser('~'), '.ssh', 'gms-%C')
+
+    def _master_command(self, *extra):
+        host, port = self._ssh_target()
+        command = ['ssh', *self._ssh_options(), '-o', f'ControlPath={self._control_path()}', *extra]
+        if port:
+            command += ['-p', port]
+        return command + [host]
+
+    def _ensure_ssh_master(self):
+        """Make sure a multiplexed SSH master for the remote is running; False if unavailable."""
+        if not (self.is_ssh and self.ssh_multiplex) or os.name == 'nt':
+            return False
         try:
-            repo_path = os.path.join(os.path.expanduser('~'), self.repo_name)
-            self.repo_path = repo_path
-
-            # Create repo directory if it doesn't exist
-            if not os.path.exists(repo_path):
-                os.makedirs(repo_path)
-
-            os.chdir(repo_path)
-
-            # Check if git is already initialized
-            if not os.path.exists(os.path.join(repo_path, '.git')):
-                # Initialize new repository
-                subprocess.run(['git', 'init'], check=True)
-                subprocess.run(['git', 'checkout', '-b', self.branch], check=True)
-
-                # Configure remote
-                try:
-                    subprocess.run(['git', 'remote', 'remove', 'origin'], check=True)
-                except subprocess.CalledProcessError:
-                    pass  # Ignore if remote doesn't exist
-
-                subprocess.run(['git', 'remote', 'add', 'origin', self.repo_url], check=True)
-
-                # Create .gitignore
-                self._create_gitignore(repo_path)
-
-                # Make initial commit if needed
-                try:
-                    subprocess.run(['git', 'add', '.gitignore'], check=True)
-                    subprocess.run(['git', 'commit', '-m', "Initial commit: Setup repository"], check=True)
-                except subprocess.CalledProcessError:
-                    pass  # Ignore if commit fails
-
-            # Copy files from source to repo
-            if os.path.exists(self.notes_path):
-                self._sync_files(self.notes_path, repo_path)
-            else:
-                raise Exception(f"Source path does not exist: {self.notes_path}")
+            check = subprocess.run(self._master_command('-O', 'check'), capture_output=True, timeout=10)
+            if check.returncode == 0:
+                return True
 
-            self.logger.info(f"Repository ready at {repo_path}")
+            os.makedirs(os.path.join(os.path.expanduser('~'), '.ssh'), mode=0o700, exist_ok=True)
+            # -f backgrounds after authentication; its inherited fds must not be pipes we wait on
+            subprocess.run(self._master_command('-M', '-N', '-f', '-o', f'ControlPersist={self.ssh_persist}',
+                                                '-o', 'ConnectTimeout=10', '-o', 'BatchMode=yes'),
+                           stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                           timeout=30, check=True)
+            self.logger.info("SSH master connection established")
             return True
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"Repository initialization failed: {e}")
-            return False
-        except Exception as e:
-            self.logger.error(f"Unexpected error during repository initialization: {e}")
+        except (subprocess.SubprocessError, OSError) as e:
+            self.logger.warning(f"SSH connection multiplexing unavailable, using plain SSH: {e}")
             return False
 
+    def close_ssh_master(self):
+        """Stop the multiplexed SSH master, if any."""
+        if self.is_ssh and self.ssh_multiplex and os.name != 'nt':
+            subprocess.run(self._master_command('-O', 'exit'), capture_output=True, timeout=10)
+
+    def _scrub_remote_url(self, repo_path):
+        """Drop the user:password older versions wrote into the origin URL in .git/config."""
+        url = self._git('remote', 'get-url', 'origin', check=False, cwd=repo_path).stdout.strip()
+        if re.match(r'^[a-z][a-z0-9+.-]*://[^/@]*:[^/@]*@', url):
+            self._git('remote', 'set-url', 'origin', self.repo_url, cwd=repo_path)
+            self.logger.info("Removed stored credentials from the origin URL")
+
     def _create_gitignore(self, repo_path):
         """Create .gitignore with common patterns."""
-        gitignore_content = """
-        .*
-        !.gitignore
-        !.github/
-        .DS_Store
-        Thumbs.db
-        *.swp
-        *.bak
-        *.tmp
-        .env
-        node_modules/
-        __pycache__/
-        *.pyc
-        """
         with open(os.path.join(repo_path, '.gitignore'), 'w') as f:
-            f.write(gitignore_content.strip())
+            f.write('\n'.join(DEFAULT_IGNORE_PATTERNS) + '\n')
+
+    def _repair_gitignore(self, repo_path):
+        """Rewrite .gitignore files from older versions, whose indented patterns git never matched."""
+        gitignore_path = os.path.join(repo_path, '.gitignore')
+        try:
+            with open(gitignore_path) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return
+        if len(lines) > 1 and all(line.startswith('        ') for line in lines[1:]) and \
+                [line.strip() for line in lines] == list(DEFAULT_IGNORE_PATTERNS):
+            self._create_gitignore(repo_path)
+            self.logger.info("Rewrote legacy .gitignore so its patterns take effect")
+
+    def _ignore_rules(self):
+        """Ignore rules of the mirror plus the user's excludes, compiled once per .gitignore change.
+
+        Files the mirror already tracks are exempt, as they are for git: a rule
+        added later (or a legacy .gitignore being repaired) must not make the
+        next commit delete them from the backup.
+        """
+        gitignore_path = os.path.join(self.repo_path, '.gitignore')
+        try:
+            mtime = os.stat(gitignore_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        key = [mtime, self.exclude]
+        if not os.path.isdir(os.path.join(self.repo_path, '.git')):
+            return IgnoreRules.from_file(gitignore_path, self.exclude)  # No mirror, so nothing tracked yet
+        if self._ignore_cache is None or self._ignore_cache[0] != key:
+            keep = self._tracked_ignored(gitignore_path, key)
+            self._ignore_cache = (key, IgnoreRules.from_file(gitignore_path, self.exclude, keep))
+        return self._ignore_cache[1]
+
+    def _tracked_ignored(self, gitignore_path, key):
+        """Tracked files matching the ignore rules; asks git only when the rules changed."""
+        cache_path = self._state_path('tracked_ignored.json')
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('key') == key:
+                return cached['paths']
+        except (OSError, ValueError, AttributeError):
+            pass
+        args = ['ls-files', '-z', '--cached', '--ignored']
+        if os.path.exists(gitignore_path):
+            args.append(f'--exclude-from={gitignore_path}')
+        else:
+            args += [f'--exclude={pattern}' for pattern in DEFAULT_IGNORE_PATTERNS]
+        args += [f'--exclude={pattern}' for pattern in self.exclude]
+        result = self._git(*args, check=False)
+        if result.returncode != 0:
+            return []
+        paths = [os.path.normpath(path) for path in result.stdout.split('\0') if path]
+        write_json_atomic(cache_path, {'key': key, 'paths': paths})
+        return paths
+
+    def _untrack_ignored(self, deleted):
+        """Drop files a commit deleted from the cached tracked-and-ignored list."""
+        rules = self._ignore_rules()
+        gone = {path for path in deleted if path in rules.keep}
+        if not gone:
+            return
+        write_json_atomic(self._state_path('tracked_ignored.json'),
+                          {'key': self._ignore_cache[0], 'paths': sorted(rules.keep - gone)})
+        self._ignore_cache = None  # Compiled again from the file on the next run
+
+    def _forget_tracked_ignored(self):
+        """Re-list tracked ignored files after a merge brought in commits from elsewhere."""
+        try:
+            os.remove(self._state_path('tracked_ignored.json'))
+        except FileNotFoundError:
+            pass
+        self._ignore_cache = None
+        self._ignore_rules()
 
     def setup_git_config(self):
-        """Setup git configuration with error handling."""
+        """Prepare the environment git runs with, instead of rewriting global config every run."""
         try:
-            ssh_command = f"ssh -i {self.ssh_key_path} -o StrictHostKeyChecking=no"
-            subprocess.run(['git', 'config', '--global', 'core.sshCommand', ssh_command], check=True)
-            subprocess.run(['git', 'config', '--global', 'pull.rebase', 'false'], check=True)
+            env = os.environ.copy()
+            if self.is_ssh:
+                ssh_command = ['ssh', *self._ssh_options()]
+                if self._ensure_ssh_master():
+                    # Only ever attach to our master; a git-spawned master would hold our pipes open
+                    ssh_command += ['-o', 'ControlMaster=no', '-o', f'ControlPath={self._control_path()}']
+                env['GIT_SSH_COMMAND'] = shlex.join(ssh_command)
+            elif self.username and self.password and not self._setup_https_credentials():
+                return False
+            self.git_env = env
             self.logger.info("Git SSH configuration updated")
             return True
-        except subprocess.CalledProcessError as e:
+        except Exception as e:
             self.logger.error(f"Git config failed: {e}")
             return False
 
@@ -202,386 +1278,1537 @@ class SSHGitBackup:
     def init_repository(self):
         """Initialize repository with improved setup."""
         try:
-            repo_path = os.path.join(os.path.expanduser('~'), self.repo_name)
+            repo_path = self.repo_path
 
             if not os.path.exists(repo_path):
                 os.makedirs(repo_path)
 
-            os.chdir(repo_path)
-
             # Check if git is already initialized
-            if not os.path.exists(os.path.join(repo_path, '.git')):
-                # Initialize new repository
-                subprocess.run(['git', 'init'], check=True)
-                subprocess.run(['git', 'checkout', '-b', self.branch], check=True)
-
-                # Configure remote
+            git_dir = os.path.join(repo_path, '.git')
+            if not os.path.exists(git_dir):
                 try:
-                    subprocess.run(['git', 'remote', 'remove', 'origin'], check=True)
+                    # Initialize new repository on the backup branch
+                    self._git('init', cwd=repo_path)
+                    self._git('symbolic-ref', 'HEAD', f'refs/heads/{self.branch}', cwd=repo_path)
+
+                    # Configure remote, tracking only the backup branch and no tags
+                    self._git('remote', 'add', '--no-tags', '-t', self.branch, 'origin', self.repo_url,
+                              cwd=repo_path)
+
+                    bootstrapped = self._bootstrap_from_remote(repo_path)
                 except subprocess.CalledProcessError:
-                    pass  # Ignore if remote doesn't exist
+                    # Never leave a history unrelated to the remote's behind; the next run retries
+                    shutil.rmtree(git_dir, ignore_errors=True)
+                    raise
 
-                subprocess.run(['git', 'remote', 'add', 'origin', self.repo_url], check=True)
+                if not bootstrapped:
+                    # Create .gitignore
+                    self._create_gitignore(repo_path)
 
-                # Create .gitignore
-                self._create_gitignore(repo_path)
+                    # Make initial commit if needed
+                    try:
+                        self._git('add', '.gitignore', cwd=repo_path)
+                        self._git('commit', '-q', '-m', "Initial commit: Setup repository", cwd=repo_path)
+                    except subprocess.CalledProcessError:
+                        pass  # Ignore if commit fails
+            else:
+                self._repair_gitignore(repo_path)
+                if not self.is_ssh:
+                    self._scrub_remote_url(repo_path)
 
-                # Make initial commit if needed
+            # Again for mirrors profiled while the untracked cache was still turned on
+            applied = self._profile_settings()
+            if self.performance_profile and (applied is None or 'untracked_cache' in applied):
                 try:
-                    subprocess.run(['git', 'add', '.gitignore'], check=True)
-                    subprocess.run(['git', 'commit', '-m', "Initial commit: Setup repository"], check=True)
-                except subprocess.CalledProcessError:
-                    pass  # Ignore if commit fails
+                    self._apply_performance_profile()
+                except OSError as e:
+                    self.logger.warning(f"Could not apply the performance profile: {e}")
 
             self.logger.info(f"Repository ready at {repo_path}")
             return True
         except subprocess.CalledProcessError as e:
-            self.logger.error(f"Repository initialization failed: {e}")
+            self.logger.error(f"Repository initialization failed: {e} {e.stderr or ''}".strip())
             return False
 
-    def _clean_submodule_state(self):
+    def _bootstrap_from_remote(self, repo_path):
+        """Continue the remote's history of self.branch in a new mirror, blobless with partial_clone.
+
+        Returns False when the remote has no such branch yet; other failures raise.
+        """
+        if self.partial_clone:
+            self._git('config', 'remote.origin.promisor', 'true', cwd=repo_path)
+            self._git('config', 'remote.origin.partialclonefilter', 'blob:none', cwd=repo_path)
+        if not self._fetch_branch(cwd=repo_path):
+            if self.partial_clone:
+                # A new history has every blob, so it stays an ordinary repository
+                for key in ('remote.origin.promisor', 'remote.origin.partialclonefilter', 'extensions.partialclone'):
+                    self._git('config', '--unset', key, cwd=repo_path, check=False)
+            self.logger.info(f"origin has no {self.branch} yet, starting a new history")
+            return False
+        if self.partial_clone:
+            # Inexact rename detection would download deleted files' contents
+            self._git('config', 'status.renames', 'false', cwd=repo_path)
+
+        remote_commit = read_ref(os.path.join(repo_path, '.git'), f'refs/remotes/origin/{self.branch}')
+        self._git('update-ref', f'refs/heads/{self.branch}', remote_commit, cwd=repo_path)
+        self._git('read-tree', 'HEAD', cwd=repo_path)  # Index matches HEAD, nothing staged
+        present = self._git('ls-tree', '--name-only', 'HEAD', '.gitignore', '.gitmodules',
+                            cwd=repo_path).stdout.split()
+        if present:
+            self._git('checkout', 'HEAD', '--', *present, cwd=repo_path, remote=True)
+        if '.gitignore' not in present:
+            self._create_gitignore(repo_path)
+        self.logger.info(f"Bootstrapped from origin/{self.branch} at {remote_commit[:12]}"
+                         f"{' (partial clone)' if self.partial_clone else ''}")
+        return True
+
+    def _apply_performance_profile(self):
+        """Turn on index v4, a split index and fsmonitor where they pass git's checks; records profile.json."""
+        git_dir = os.path.join(self.repo_path, '.git')
+
+        def ok(*args):
+            return self._git(*args, check=False).returncode == 0
+
+        applied = {}
+        ok('config', 'index.version', '4')  # Also for indexes git writes from scratch
+        ok('update-index', '--index-version', '4')
+        applied['index_version_4'] = self._index_version(git_dir) == 4
+        if not applied['index_version_4']:
+            ok('config', '--unset', 'index.version')
+            ok('update-index', '--index-version', '2')
+
+        applied['split_index'] = ok('config', 'core.splitIndex', 'true') and \
+            ok('update-index', '--split-index') and \
+            any(name.startswith('sharedindex.') for name in os.listdir(git_dir))
+        if not applied['split_index']:
+            ok('config', '--unset', 'core.splitIndex')
+            ok('update-index', '--no-split-index')
+
+        # Undo it on mirrors profiled by earlier versions
+        ok('config', '--unset', 'core.untrackedCache')
+        ok('update-index', '--no-untracked-cache')
+
+        applied['fsmonitor'] = not self.direct_staging and ok('config', 'core.fsmonitor', 'true') and \
+            ok('fsmonitor--daemon', 'start') and ok('fsmonitor--daemon', 'status')
+        if not applied['fsmonitor']:
+            ok('config', '--unset', 'core.fsmonitor')
+
+        version = self._git('--version', check=False).stdout.strip()
+        write_json_atomic(self._state_path('profile.json'), {'git': version, 'applied': applied})
+        self.logger.info("Performance profile: " + ', '.join(f"{name} {'on' if on else 'off'}"
+                                                              for name, on in applied.items()))
+        return applied
+
+    def _profile_settings(self):
+        """Settings recorded in profile.json ({name: turned on}), None if the mirror was never profiled."""
+        try:
+            with open(self._state_path('profile.json'), 'r', encoding='utf-8') as f:
+                return json.load(f).get('applied')
+        except (OSError, ValueError):
+            return None
+
+    def stop_fsmonitor(self):
+        """Stop the fsmonitor daemon the profile turned on, so none is left behind on exit."""
+        if (self._profile_settings() or {}).get('fsmonitor'):
+            self._git('fsmonitor--daemon', 'stop', check=False)
+
+    def _index_version(self, git_dir):
+        """Format version from the index header, None if there is no readable index."""
+        try:
+            with open(os.path.join(git_dir, 'index'), 'rb') as f:
+                header = f.read(8)
+        except OSError:
+            return None
+        return int.from_bytes(header[4:], 'big') if header[:4] == b'DIRC' else None
+
+    def _fetch_branch(self, cwd=None, phase=None):
+        """Fetch only self.branch from origin, negotiating from our own tips of it.
+
+        The refspec is passed explicitly, so mirrors created before the remote
+        was narrowed skip other branches and tags as well. Returns False when the
+        remote has no such branch yet.
+        """
+        git_dir = os.path.join(cwd or self.repo_path, '.git')
+        local_ref = f'refs/heads/{self.branch}'
+        remote_ref = f'refs/remotes/origin/{self.branch}'
+        # Only existing refs, git rejects a tip that does not resolve
+        tips = [f'--negotiation-tip={ref}' for ref in (local_ref, remote_ref) if read_ref(git_dir, ref)]
+        result = self._git('fetch', '--no-tags', *tips, 'origin', f'+{local_ref}:{remote_ref}',
+                           check=False, cwd=cwd, remote=True, phase=phase)
+        if result.returncode != 0:
+            # Exit code 2: the remote answered and has no such branch (stderr may be translated)
+            missing = self._git('ls-remote', '--exit-code', 'origin', local_ref,
+                                check=False, cwd=cwd, remote=True, phase=phase)
+            if missing.returncode == 2:
+                return False  # Nothing pushed yet
+            raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+        return True
+
+    def _git(self, *args, check=True, input=None, cwd=None, staging=False, remote=False, phase=None):
+        """Run one git command in the mirror and time it; staging=True runs it on the staging work tree."""
+        env = self.git_env
+        if staging and self.direct_staging:
+            env = dict(env or os.environ, GIT_DIR=os.path.join(self.repo_path, '.git'),
+                       GIT_WORK_TREE=self.notes_path)
+        command = ['git']
+        if self.credentials_file:
+            command += ['-c', 'credential.helper=',
+                        '-c', f'credential.helper=store --file={shlex.quote(self.credentials_file)}']
+        slot = self.remote_slot if remote and self.remote_slot is not None else contextlib.nullcontext()
+        with slot:
+            started = time.monotonic()
+            result = subprocess.run(command + list(args), cwd=cwd or self.repo_path, env=env, input=input,
+                                    capture_output=True, text=True, encoding='utf-8', errors='surrogateescape')
+            elapsed = time.monotonic() - started
+            self.git_calls.append((args[0], elapsed))
+            self.report.git_call(phase, elapsed)
+        if check and result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+        return result
+
+    def _log_git_calls(self):
+        """Summarize the git invocations of the last operation."""
+        if self.git_calls:
+            total = sum(duration for _, duration in self.git_calls)
+            detail = ', '.join(f"{name} {duration:.3f}s" for name, duration in self.git_calls)
+            self.logger.info(f"git: {len(self.git_calls)} call(s) in {total:.3f}s ({detail})")
+
+    def _branch_tips(self):
+        """Local and remote-tracking tips of self.branch from a single for-each-ref."""
+        local_ref = f'refs/heads/{self.branch}'
+        remote_ref = f'refs/remotes/origin/{self.branch}'
+        output = self._git('for-each-ref', '--format=%(refname) %(objectname)', local_ref, remote_ref).stdout
+        tips = dict(line.split(' ', 1) for line in output.splitlines())
+        return tips.get(local_ref, ''), tips.get(remote_ref, '')
+
+    def _prepare_direct_staging(self):
+        """Make the mirror's git dir usable against notes_path as its work tree."""
+        try:
+            if not os.path.isdir(self.notes_path):
+                raise Exception(f"Source path does not exist: {self.notes_path}")
+
+            # The notes folder has no copy of our .gitignore, so apply it as a repo-local exclude
+            gitignore_path = os.path.join(self.repo_path, '.gitignore')
+            exclude_path = os.path.join(self.repo_path, '.git', 'info', 'exclude')
+            if not os.path.exists(gitignore_path):
+                return True
+            with open(gitignore_path) as f:
+                patterns = f.read().rstrip('\n') + '\n' + ''.join(f"{pattern}\n" for pattern in self.exclude)
+            try:
+                with open(exclude_path) as f:
+                    if f.read() == patterns:
+                        return True  # Already prepared on an earlier run
+            except OSError:
+                pass
+            os.makedirs(os.path.dirname(exclude_path), exist_ok=True)
+            with open(exclude_path, 'w') as f:
+                f.write(patterns)
+
+            # Keep the committed .gitignore instead of staging its deletion
+            if not os.path.exists(os.path.join(self.notes_path, '.gitignore')):
+                self._git('update-index', '--skip-worktree', '.gitignore', check=False)
+            return True
+        except Exception as e:
+            self.logger.error(f"Failed to prepare direct staging: {e}")
+            return False
+
+    def _remote_has_new_commits(self, remote_commit):
+        """Whether the remote tip contains commits that HEAD does not."""
+        if not remote_commit:
+            return False
+        return self._git('merge-base', '--is-ancestor', remote_commit, 'HEAD', check=False).returncode != 0
+
+    def _registered_submodules(self):
+        """Submodules of the mirror (path -> (name, url)), parsed once per .gitmodules change."""
+        gitmodules_path = os.path.join(self.repo_path, '.gitmodules')
+        try:
+            key = os.stat(gitmodules_path).st_mtime_ns
+        except OSError:
+            return {}
+        if self._gitmodules_cache is None or self._gitmodules_cache[0] != key:
+            self._gitmodules_cache = (key, parse_gitmodules(gitmodules_path))
+        return self._gitmodules_cache[1]
+
+    def _clean_submodule_state(self, rel_path, name):
         """Clean up problematic submodule state."""
         try:
             # Remove submodule from .gitmodules if it exists
-            if os.path.exists('.gitmodules'):
-                subprocess.run(['git', 'config', '--file', '.gitmodules', '--remove-section',
-                              'submodule.Turtle_notes/cs_notes'], check=False)
+            if os.path.exists(os.path.join(self.repo_path, '.gitmodules')):
+                self._git('config', '--file', '.gitmodules', '--remove-section',
+                          f'submodule.{name}', check=False)
 
             # Remove submodule from .git/config
-            subprocess.run(['git', 'config', '--remove-section',
-                           'submodule.Turtle_notes/cs_notes'], check=False)
+            self._git('config', '--remove-section', f'submodule.{name}', check=False)
 
             # Clean up submodule directories
-            subprocess.run(['git', 'rm', '--cached', '-f', 'Turtle_notes/cs_notes'], check=False)
+            self._git('rm', '--cached', '-f', rel_path, check=False)
 
             # Remove the submodule directory from .git
-            git_submodule_path = os.path.join('.git', 'modules', 'Turtle_notes/cs_notes')
+            git_submodule_path = os.path.join(self.repo_path, '.git', 'modules', name)
             if os.path.exists(git_submodule_path):
                 shutil.rmtree(git_submodule_path, ignore_errors=True)
 
-            # Commit the cleanup if there are changes
-            try:
-                subprocess.run(['git', 'add', '.gitmodules'], check=False)
-                subprocess.run(['git', 'commit', '-m', "Clean up submodule state"], check=False)
-            except:
-                pass
-
             return True
         except Exception as e:
             self.logger.error(f"Error cleaning submodule state: {e}")
             return False
 
-    def _initialize_submodule(self, submodule_path):
-        """Initialize a submodule with proper error handling."""
-        try:
-            # Get absolute path of the submodule
-            abs_submodule_path = os.path.join(self.notes_path, 'Turtle_notes/cs_notes')
-            rel_submodule_path = 'Turtle_notes/cs_notes'
-
-            # Check if it's already a submodule
-            submodule_status = subprocess.run(
-                ['git', 'submodule', 'status', rel_submodule_path],
-                capture_output=True,
-                text=True
-            ).stdout.strip()
+    def _register_submodules(self):
+        """Add nested repositories of the notes folder that the mirror does not know yet.
 
-            if not submodule_status:
-                # Clean up any existing problematic state
-                self._clean_submodule_state()
+        Candidates come from notes_path/.gitmodules and the submodules argument.
+        Already registered ones cost no git call at all.
+        """
+        candidates = {path: url for path, (_, url) in parse_gitmodules(
+            os.path.join(self.notes_path, '.gitmodules')).items()}
+        for path in self.submodules:
+            candidates.setdefault(os.path.normpath(path), None)
+        registered = self._registered_submodules()
+
+        ok = True
+        for rel_path, url in sorted(candidates.items()):
+            source_path = os.path.join(self.notes_path, rel_path)
+            if rel_path in registered or not os.path.exists(os.path.join(source_path, '.git')):
+                continue
+            try:
+                if not url or url.startswith(('./', '../')):
+                    # Relative or missing in .gitmodules, use the nested repository's own remote
+                    url = self._git('config', '--get', 'remote.origin.url',
+                                    cwd=source_path, check=False).stdout.strip()
+                if not url:
+                    raise Exception(f"No remote URL found in {source_path}")
+                submodule_path = rel_path.replace(os.sep, '/')
+                added = self._git('submodule', 'add', url, submodule_path, check=False)
+                if added.returncode != 0 and 'already exists in the index' in added.stderr:
+                    # If it's already in the index, try to recover
+                    self._git('submodule', 'init', '--', submodule_path, check=False)
+                    self._git('submodule', 'update', '--', submodule_path, check=False)
+                elif added.returncode != 0:
+                    # Leftovers of an earlier attempt, clean up and retry once
+                    self._clean_submodule_state(submodule_path, submodule_path)
+                    self._git('submodule', 'add', url, submodule_path)
+                self.dirty_submodules.add(rel_path)
+                self.logger.info(f"Registered submodule {submodule_path}")
+            except Exception as e:
+                self.logger.error(f"Failed to initialize submodule {rel_path}: {e}")
+                ok = False
+        return ok
+
+    def _owning_submodule(self, rel_path, submodule_paths):
+        """The submodule path rel_path lies in, or None."""
+        for submodule_path in submodule_paths:
+            if rel_path.startswith(submodule_path + os.sep):
+                return submodule_path
+        return None
 
-                # Initialize new submodule
+    def _commit_submodules(self, paths):
+        """Stage and commit inside each of the given submodules, in parallel."""
+        message = f"Submodule update: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+
+        def commit(rel_path):
+            cwd = os.path.join(self.repo_path, rel_path)
+            self._git('add', '-A', cwd=cwd, phase='submodule')
+            result = self._git('commit', '-q', '-m', message, cwd=cwd, check=False, phase='submodule')
+            if result.returncode != 0 and 'nothing to commit' not in result.stdout + result.stderr:
+                raise Exception(result.stderr.strip() or f"git commit exited with {result.returncode}")
+
+        with ThreadPoolExecutor(max_workers=min(len(paths), self.copy_workers)) as pool:
+            futures = {pool.submit(commit, rel_path): rel_path for rel_path in paths}
+            for future in as_completed(futures):
+                rel_path = futures[future]
                 try:
-                    # First, check if the target directory exists and is a git repo
-                    target_git_dir = os.path.join(abs_submodule_path, '.git')
-                    if os.path.exists(target_git_dir):
-                        # Get the remote URL from the existing repository
-                        os.chdir(abs_submodule_path)
-                        remote_url = subprocess.run(
-                            ['git', 'config', '--get', 'remote.origin.url'],
-                            capture_output=True,
-                            text=True
-                        ).stdout.strip()
-                        os.chdir(self.repo_path)
-
-                        if remote_url:
-                            # Add submodule using the existing remote URL
-                            subprocess.run(['git', 'submodule', 'add', remote_url, rel_submodule_path], check=True)
-                        else:
-                            raise Exception("No remote URL found in existing repository")
-                    else:
-                        raise Exception("Target directory is not a git repository")
+                    future.result()
+                    self.dirty_submodules.discard(rel_path)
+                except Exception as e:
+                    self.dirty_submodules.add(rel_path)  # Retried on the next run
+                    self.logger.warning(f"Submodule update warning ({rel_path}): {e}")
 
-                except subprocess.CalledProcessError as e:
-                    if "already exists in the index" in str(e.stderr):
-                        # If it's already in the index, try to recover
-                        subprocess.run(['git', 'submodule', 'init'], check=False)
-                        subprocess.run(['git', 'submodule', 'update'], check=False)
-                    else:
-                        raise
+    def backup(self, force=False, paths=None):
+        """Complete backup method with enhanced error handling and support for both SSH and HTTPS.
 
-            return True
-        except Exception as e:
-            self.logger.error(f"Failed to initialize submodule: {e}")
-            return False
+        paths optionally limits the sync to files changed below notes_path (see watch()).
+        When neither the notes nor the repository changed since the last clean run,
+        returns straight away without spawning git.
+        """
+        self.git_calls = []
+        self.fast_path_taken = False
+        self.report = BackupReport()
+        ok = False
+        try:
+            state = self._load_state()
+            state['runs'] = state.get('runs', 0) + 1
+            self.expected_files = state.get('tree_files') if paths is None else None
+            self.dirty_submodules = set(state.get('dirty_submodules', []))
+            self.pending_push = dict(state.get('pending_push', {}))
+            with self.report.span('scan'):
+                changed, snapshot = self._scan_for_changes(paths)
+            if not changed and not force and not self.dirty_submodules and not self._push_due() and \
+                    self._repository_unchanged(state):
+                state['fast_path_hits'] = state.get('fast_path_hits', 0) + 1
+                self._record_tree_size(state, paths)
+                self._save_state(state)
+                self.fast_path_taken = True
+                self._reset_counts()
+                if snapshot is not None:
+                    snapshot.discard()
+                self.logger.info(f"No changes detected to backup (fast path taken on "
+                                 f"{state['fast_path_hits']} of {state['runs']} runs)")
+                ok = True
+                return True
 
-    def backup(self, force=False):
-        """Complete backup method with enhanced error handling and support for both SSH and HTTPS."""
+            try:
+                ok = self._run_backup(force, paths)
+            finally:
+                if snapshot is not None:
+                    # Taken before git add, so anything edited since then still looks changed next time
+                    snapshot.commit() if ok else snapshot.discard()
+            state['clean'] = ok
+            state['git'] = self._git_state_signature() if ok else None
+            state['dirty_submodules'] = sorted(self.dirty_submodules)
+            state['pending_push'] = self.pending_push
+            if ok:
+                self._record_tree_size(state, paths)
+            self._save_state(state)
+            return ok
+        finally:
+            self._log_git_calls()
+            self._cleanup_https_credentials()
+            self.report.finish(ok, self.fast_path_taken)
+            self._publish_report()
+
+    def _record_tree_size(self, state, paths):
+        if paths is None:
+            counters = self.report.counters
+            state['tree_files'] = max(counters['files_scanned'], counters['files_examined'])
+
+    def progress(self):
+        """(files done, files expected or None) of the running backup; safe to poll from another thread."""
+        counters = self.report.counters
+        return max(counters['files_scanned'], counters['files_examined']), self.expected_files
+
+    def _publish_report(self):
+        """Append the run's report to report_log and refresh metrics_file, if configured."""
         try:
-            # Modify the remote URL to include credentials if using HTTPS
-            if not self.is_ssh and self.username and self.password:
-                parsed_url = self.repo_url.rstrip('/')
-                if not parsed_url.startswith('https://'):
-                    parsed_url = 'https://' + parsed_url.split('://')[-1]
-                self.repo_url = parsed_url.replace('https://', f'https://{self.username}:{self.password}@')
+            if self.report_log:
+                with open(self.report_log, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'repo': self.repo_path, **self.report.to_dict()}) + '\n')
+            if self.metrics_file:
+                # Written via rename, the textfile collector must never see a partial file
+                tmp_path = self.metrics_file + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(self.report.prometheus(self.repo_path))
+                os.replace(tmp_path, self.metrics_file)
+        except OSError as e:
+            self.logger.warning(f"Failed to write backup report: {e}")
+
+    def _run_backup(self, force, paths):
+        """Sync, commit, merge and push; the body of backup()."""
+        try:
+            repo_path = self.repo_path
 
-            # Setup repository path
-            repo_path = os.path.join(os.path.expanduser('~'), self.repo_name)
-            self.repo_path = repo_path
+            # Setup git configuration based on authentication method
+            with self.report.span('config'):
+                configured = self.setup_git_config()
+            if not configured:
+                self.logger.error("Git configuration failed")
+                return False
 
             # Initialize repository if needed
-            if not self.init_repository():
+            with self.report.span('init'):
+                initialized = self.init_repository()
+            if not initialized:
                 self.logger.error("Repository initialization failed")
                 return False
 
-            os.chdir(repo_path)
+            if self.direct_staging:
+                # Stage straight from notes_path; no mirror copy, no submodule juggling
+                with self.report.span('init'):
+                    prepared = self._prepare_direct_staging()
+                if not prepared:
+                    return False
+                self._reset_counts()
+            else:
+                # Register new nested repositories with error handling
+                with self.report.span('submodule'):
+                    submodule_success = self._register_submodules()
+                if not submodule_success:
+                    self.logger.warning("Continuing backup without submodule initialization")
 
-            # Setup git configuration based on authentication method
-            if not self.setup_git_config():
-                self.logger.error("Git configuration failed")
-                return False
+                # Sync files from source to destination, noting which submodules it touches
+                submodule_paths = list(self._registered_submodules())
 
-            # Initialize submodule with error handling
-            submodule_success = self._initialize_submodule('Turtle_notes/cs_notes')
-            if not submodule_success:
-                self.logger.warning("Continuing backup without submodule initialization")
+                def note_submodule(rel_path, status):
+                    owner = self._owning_submodule(rel_path, submodule_paths)
+                    if owner is not None:
+                        self.dirty_submodules.add(owner)
 
-            # Sync files from source to destination
-            try:
-                self._sync_files(self.notes_path, repo_path)
-            except Exception as e:
-                self.logger.error(f"File synchronization failed: {e}")
-                return False
+                try:
+                    self._sync_files(self.notes_path, repo_path, paths=paths,
+                                     on_change=note_submodule if submodule_paths else None)
+                except Exception as e:
+                    self.logger.error(f"File synchronization failed: {e}")
+                    return False
 
-            # Handle submodules if they exist
-            try:
-                subprocess.run(['git', 'submodule', 'foreach', 'git', 'add', '-A'], check=False)
-                subprocess.run(['git', 'submodule', 'foreach', 'git', 'commit', '-m',
-                              f"Submodule update: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"],
-                              check=False)
-            except Exception as e:
-                self.logger.warning(f"Submodule update warning: {e}")
+                # Only submodules whose files changed (or whose last commit failed) are entered
+                dirty = sorted(self.dirty_submodules.intersection(submodule_paths))
+                if dirty:
+                    self._commit_submodules(dirty)
 
             # Add all changes including submodule references
             try:
-                subprocess.run(['git', 'add', '-A'], check=True)
+                self._git('add', '-A', staging=True, phase='add')
+                if self.chunk_threshold and os.path.isdir(os.path.join(repo_path, CHUNK_DIR)):
+                    # The store is a dot-directory, so the '.*' ignore pattern has to be overridden
+                    # Leaves out temp files an older version could leave inside the store
+                    self._git('add', '-f', '--', CHUNK_DIR, f':(exclude,glob){CHUNK_DIR}/**/.*',
+                              staging=True, phase='add')
             except subprocess.CalledProcessError as e:
-                self.logger.error(f"Failed to add files to git: {e}")
+                self.logger.error(f"Failed to add files to git: {e.stderr.strip() or e}")
                 return False
 
-            # Get status and check for changes
+            # Get the staged changes once, in a machine-readable form
             try:
-                status_output = subprocess.run(
-                    ['git', 'status', '--porcelain'],
-                    capture_output=True,
-                    text=True
-                ).stdout.strip()
+                status_output = self._git('status', '--porcelain=v2', '-z', '--untracked-files=no',
+                                          staging=True, phase='status').stdout
             except subprocess.CalledProcessError as e:
-                self.logger.error(f"Failed to get git status: {e}")
+                self.logger.error(f"Failed to get git status: {e.stderr.strip() or e}")
                 return False
+            staged = [(xy, path) for xy, path in parse_status_v2(status_output) if xy[0] != '.']
+
+            if self.direct_staging:
+                # Nothing was copied, so take the per-file summary from the index
+                for xy, path in staged:
+                    if xy[0] == 'D':
+                        self._count_change(path, 'deleted')
+                    elif xy[0] == 'R':
+                        self._count_change(path, 'renamed')
+                    else:
+                        try:
+                            size = os.path.getsize(os.path.join(self.notes_path, path))
+                        except OSError:
+                            size = None
+                        self._count_change(path, 'updated', size)
 
             # Proceed with commit if there are changes or force flag is set
-            if status_output or force:
+            if staged or force:
                 # Generate commit message
                 commit_msg = self._generate_commit_message()
 
-                # Attempt to commit changes
+                # Attempt to commit changes; -q skips the diffstat git would otherwise compute
                 try:
-                    subprocess.run(['git', 'commit', '-m', commit_msg], check=True)
+                    self._git('commit', '-q', '-F', '-', input=commit_msg, staging=True, phase='commit')
                 except subprocess.CalledProcessError as e:
-                    if "nothing to commit" not in str(e.stderr):
-                        self.logger.error(f"Commit failed: {e}")
+                    if "nothing to commit" not in e.stdout + e.stderr:
+                        self.logger.error(f"Commit failed: {e.stderr.strip() or e}")
                         return False
                     self.logger.info("No changes to commit")
+                    return self._push_pending() if self._push_due() else True
+                self._untrack_ignored(path for xy, path in staged if xy[0] == 'D')
+
+                # Hold the push back until the push policy says enough has accumulated
+                pending = self.pending_push
+                pending['commits'] = pending.get('commits', 0) + 1
+                pending['bytes'] = pending.get('bytes', 0) + self.sync_bytes['updated']
+                pending.setdefault('since', time.time())
+                if not self._push_due():
+                    self.logger.info(f"Committed locally, push deferred ({pending['commits']} commit(s), "
+                                     f"{format_size(pending['bytes'])} pending)")
                     return True
-
-                # Pull changes with conflict handling
-                try:
-                    # Fetch first to check for updates
-                    subprocess.run(['git', 'fetch', 'origin'], check=True)
-
-                    # Check if we need to pull
-                    local_commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
-                                               capture_output=True, text=True).stdout.strip()
-                    remote_commit = subprocess.run(['git', 'rev-parse', f'origin/{self.branch}'],
-                                                capture_output=True, text=True).stdout.strip()
-
-                    if local_commit != remote_commit:
-                        # Try pulling changes
-                        try:
-                            subprocess.run(['git', 'pull', '--no-rebase'], check=True)
-                        except subprocess.CalledProcessError:
-                            self.logger.warning("Pull failed, attempting to continue")
-
-                            # Check for conflicts
-                            if "CONFLICT" in subprocess.run(['git', 'status'],
-                                                          capture_output=True, text=True).stdout:
-                                self.logger.error("Merge conflicts detected")
-                                self._handle_conflicts()
-                                return False
-
-                except subprocess.CalledProcessError as e:
-                    self.logger.error(f"Failed to sync with remote: {e}")
-                    return False
-
-                # Push changes with retry logic and credential handling
-                max_retries = 3
-                for attempt in range(max_retries):
-                    try:
-                        # Set up push command with credentials if using HTTPS
-                        push_cmd = ['git', 'push']
-                        if attempt > 0:
-                            user_response = messagebox.askyesno(
-                                "Push Failed",
-                                "Normal push failed. Would you like to force push? "
-                                "This will overwrite remote changes!"
-                            )
-                            if user_response:
-                                push_cmd.append('-f')
-                            else:
-                                self.logger.warning("Push cancelled by user")
-                                return False
-
-                        push_cmd.extend(['origin', self.branch])
-
-                        # Execute push command
-                        subprocess.run(push_cmd, check=True)
-                        break  # If push successful, break the retry loop
-
-                    except subprocess.CalledProcessError as e:
-                        if attempt == max_retries - 1:  # Last attempt failed
-                            self.logger.error(f"Failed to push changes after {max_retries} attempts: {e}")
-                            return False
-                        self.logger.warning(f"Push attempt {attempt + 1} failed, retrying...")
-                        time.sleep(2)  # Wait before retry
-
-                self.logger.info("Changes successfully pushed to repository")
-                return True
+                return self._push_pending()
 
             else:
                 self.logger.info("No changes detected to backup")
+                if self._push_due():
+                    return self._push_pending()  # The push window closed while nothing changed
                 return True
 
         except subprocess.CalledProcessError as e:
             error_message = str(e)
-            if hasattr(e, 'stderr') and e.stderr:
-                error_message = e.stderr.decode()
+            if e.stderr:
+                error_message = e.stderr.strip()
             self.logger.error(f"Backup failed: {error_message}")
             return False
         except Exception as e:
             self.logger.error(f"Unexpected error during backup: {e}")
             return False
-        finally:
-            # Clean up credentials if using HTTPS
-            if not self.is_ssh:
-                credentials_file = os.path.expanduser('~/.git-credentials')
-                if os.path.exists(credentials_file):
-                    try:
-                        os.remove(credentials_file)
-                        subprocess.run(['git', 'config', '--global', '--unset', 'credential.helper'], check=True)
-                    except Exception as e:
-                        self.logger.warning(f"Failed to clean up credentials: {e}")
 
-    def _sync_files(self, source, destination):
-        """Improved sync method with better change detection."""
+    def _push_pending(self):
+        """Merge remote changes and push the local commits, clearing the pending push on success."""
+        # Merge remote changes with conflict handling
         try:
-            # Reset backup status for new sync
-            self.backup_status = {}
+            # Fetch first to check for updates
+            self._fetch_branch(phase='fetch')
+
+            # Both tips in one call; merge only if the remote has commits we lack
+            with self.report.span('fetch'):
+                local_commit, remote_commit = self._branch_tips()
+                needs_merge = remote_commit and remote_commit != local_commit and \
+                    self._remote_has_new_commits(remote_commit)
+
+            if needs_merge and self.direct_staging:
+                # Merging would write remote changes straight into notes_path
+                self.logger.error("Remote branch has diverged; refusing to merge into the notes folder "
+                                  "in direct staging mode. Run a mirror backup to reconcile.")
+                return False
 
-            # Ensure destination directory exists
-            os.makedirs(destination, exist_ok=True)
-
-            # Get lists of files
-            source_files = set()
-            for root, _, files in os.walk(source):
-                for file in files:
-                    rel_path = os.path.relpath(os.path.join(root, file), source)
-                    source_files.add(rel_path)
-
-            dest_files = set()
-            for root, _, files in os.walk(destination):
-                if '.git' not in root.split(os.sep):  # Skip .git directory
-                    for file in files:
-                        rel_path = os.path.relpath(os.path.join(root, file), destination)
-                        dest_files.add(rel_path)
-
-            # Copy new and modified files
-            for rel_path in source_files:
-                src_file = os.path.join(source, rel_path)
-                dest_file = os.path.join(destination, rel_path)
-
-                # Create destination directory if needed
-                os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+            if needs_merge:
+                # The fetch above already has the commits, so merge instead of pulling again
+                merge = self._git('merge', '--no-edit', f'origin/{self.branch}', check=False,
+                                  phase='pull')
+                if merge.returncode == 0:
+                    # Remote changes landed in the mirror, so the manifest no longer describes it
+                    SyncManifest(self._manifest_path(self.repo_path)).invalidate()
+                    self._forget_tracked_ignored()
+                else:
+                    self.logger.warning("Pull failed, attempting to continue")
+
+                    # Check for conflicts
+                    if "CONFLICT" in merge.stdout:
+                        self.logger.error("Merge conflicts detected")
+                        self._handle_conflicts()
+                        return False
+
+        except subprocess.CalledProcessError as e:
+            self.logger.error(f"Failed to sync with remote: {e.stderr.strip() or e}")
+            return False
+
+        # Push changes with retry logic and credential handling
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                # Set up push command with credentials if using HTTPS
+                push_cmd = ['push']
+                if attempt > 0 and self.confirm_force_push is not None:
+                    if self.confirm_force_push():
+                        push_cmd.append('-f')
+                    else:
+                        self.logger.warning("Push cancelled by user")
+                        return False
+
+                push_cmd.extend(['origin', self.branch])
+
+                # Execute push command
+                self._git(*push_cmd, remote=True, phase='push')
+                break  # If push successful, break the retry loop
+
+            except subprocess.CalledProcessError as e:
+                if attempt == max_retries - 1:  # Last attempt failed
+                    self.logger.error(f"Failed to push changes after {max_retries} attempts: "
+                                      f"{e.stderr.strip() or e}")
+                    return False
+                self.logger.warning(f"Push attempt {attempt + 1} failed, retrying...")
+                time.sleep(2)  # Wait before retry
+
+        self.logger.info("Changes successfully pushed to repository")
+        self.pending_push = {}
+        return True
+
+    def _push_due(self):
+        """Whether the pending local commits should be pushed now.
+
+        Without a push policy every commit is pushed straight away; otherwise once
+        the oldest pending commit is push_interval seconds old, or push_commits
+        commits or push_bytes bytes of changed files have accumulated.
+        """
+        pending = self.pending_push
+        if not pending.get('commits'):
+            return False
+        if self.push_interval is None and self.push_commits is None and self.push_bytes is None:
+            return True
+        return (self.push_interval is not None and time.time() - pending['since'] >= self.push_interval) or \
+            (self.push_commits is not None and pending['commits'] >= self.push_commits) or \
+            (self.push_bytes is not None and pending['bytes'] >= self.push_bytes)
+
+    def flush(self):
+        """Push the commits held back by the push policy now, e.g. before shutting down."""
+        self.git_calls = []
+        state = self._load_state()
+        self.pending_push = dict(state.get('pending_push', {}))
+        if not self.pending_push.get('commits'):
+            return True
+        try:
+            self.logger.info(f"Flushing {self.pending_push['commits']} unpushed commit(s)")
+            ok = self.setup_git_config() and self._push_pending()
+            state['pending_push'] = self.pending_push
+            if ok and state.get('clean'):
+                state['git'] = self._git_state_signature()  # A merge may have moved HEAD
+            self._save_state(state)
+            return ok
+        finally:
+            self._log_git_calls()
+            self._cleanup_https_credentials()
+
+    def _cleanup_https_credentials(self):
+        """Clean up credentials if using HTTPS."""
+        if self.credentials_file:
+            try:
+                if os.path.exists(self.credentials_file):
+                    os.remove(self.credentials_file)
+                self.credentials_file = None
+            except Exception as e:
+                self.logger.warning(f"Failed to clean up credentials: {e}")
+
+    def _state_path(self, name):
+        """Path of a bookkeeping file kept in the mirror's .git/backup directory."""
+        return os.path.join(self.repo_path, '.git', 'backup', name)
+
+    def _snapshot_path(self):
+        """Manifest of the notes tree as last staged in direct staging mode."""
+        return self._state_path('snapshot.jsonl')
 
+    def _load_state(self):
+        try:
+            with open(self._state_path('state.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, state):
+        if os.path.isdir(os.path.join(self.repo_path, '.git')):
+            write_json_atomic(self._state_path('state.json'), state)
+
+    def _git_state_signature(self):
+        """Cheap fingerprint of HEAD and the index (and those of submodules), read without running git."""
+        git_dir = os.path.join(self.repo_path, '.git')
+        signature = self._head_and_index(git_dir)
+        if signature is None:
+            return None
+        for rel_path in sorted(self._registered_submodules()):
+            signature.append([rel_path, self._head_and_index(self._submodule_git_dir(rel_path))])
+        return signature
+
+    def _head_and_index(self, git_dir):
+        if git_dir is None:
+            return None
+        try:
+            index = os.stat(os.path.join(git_dir, 'index'))
+            with open(os.path.join(git_dir, 'HEAD'), 'r', encoding='utf-8') as f:
+                head = f.read().strip()
+            if head.startswith('ref: '):
+                head = read_ref(git_dir, head[5:])
+        except OSError:
+            return None
+        return [index.st_size, index.st_mtime_ns, head]
+
+    def _submodule_git_dir(self, rel_path):
+        """Git directory of a submodule in the mirror, following its '.git' file."""
+        dot_git = os.path.join(self.repo_path, rel_path, '.git')
+        if os.path.isdir(dot_git):
+            return dot_git
+        try:
+            with open(dot_git, 'r', encoding='utf-8') as f:
+                target = f.read().strip()
+        except OSError:
+            return None
+        if not target.startswith('gitdir: '):
+            return None
+        return os.path.normpath(os.path.join(os.path.dirname(dot_git), target[8:]))
+
+    def _repository_unchanged(self, state):
+        """Whether the last run finished cleanly and nobody touched HEAD or the index since."""
+        signature = self._git_state_signature()
+        return bool(state.get('clean')) and signature is not None and state.get('git') == signature \
+            and not os.path.exists(self._journal_path(self.repo_path))
+
+    def _scan_for_changes(self, paths=None):
+        """Compare notes_path with the last recorded manifest without running git.
+
+        Returns (changed, snapshot). The snapshot is a ManifestWriter describing
+        the current tree, only produced in direct staging mode; backup() commits it
+        once the run succeeds. Mirror mode keeps its manifest in _sync_files.
+        """
+        manifest_path = self._snapshot_path() if self.direct_staging else self._manifest_path(self.repo_path)
+        manifest = SyncManifest(manifest_path)
+        # Never create .git/backup before init_repository() has run
+        collect = self.direct_staging and os.path.isdir(os.path.join(self.repo_path, '.git'))
+        if not os.path.isdir(self.notes_path):
+            return True, None
+        if not manifest.load():
+            paths = None  # Nothing to diff against, so a snapshot needs the whole tree
+            if not collect:
+                return True, None
+
+        snapshot = manifest.writer() if collect else None
+        changed = False
+        try:
+            for rel_path, entry, old in merge_sorted(self._scan_source(self.notes_path, paths), manifest):
+                if entry is None:
+                    if paths is None or self._in_scope(rel_path, paths):
+                        changed = True  # Deleted since the last run
+                        if not collect:
+                            return True, None
+                    elif collect:
+                        snapshot.write(rel_path, old)
+                    continue
+                self.report.count('files_scanned')
                 try:
-                    # Copy if file is new or modified
-                    if not os.path.exists(dest_file) or \
-                       os.path.getmtime(src_file) > os.path.getmtime(dest_file) or \
-                       os.path.getsize(src_file) != os.path.getsize(dest_file):
-                        shutil.copy2(src_file, dest_file)
-                        self.backup_status[rel_path] = 'updated'
-                        self.logger.info(f"Updated: {rel_path}")
-                except Exception as e:
-                    self.logger.error(f"Failed to copy {rel_path}: {e}")
-                    self.backup_status[rel_path] = 'failed'
+                    st = entry.stat()
+                except OSError:
+                    changed = True
+                    if not collect:
+                        return True, None
+                    continue
+                signature = (st.st_size, st.st_mtime_ns, st.st_ino)
+                if old is not None and tuple(old[:3]) == signature:
+                    if collect:
+                        snapshot.write(rel_path, old)
+                    continue
+                changed = True
+                if not collect:
+                    return True, None
+                snapshot.write(rel_path, (*signature, None))
+        except BaseException:
+            if snapshot is not None:
+                snapshot.discard()
+            raise
+        return changed, snapshot
+
+    def _manifest_path(self, destination):
+        """Location of the sync manifest, kept inside the mirror's .git directory."""
+        return os.path.join(destination, '.git', 'backup', 'manifest.jsonl')
+
+    def _journal_path(self, destination):
+        """Location of the journal of an unfinished sync, next to the manifest."""
+        return os.path.join(destination, '.git', 'backup', 'journal.jsonl')
+
+    def _chunk_tmp_dir(self, destination):
+        """Where chunks are written before they move into the store, outside the work tree."""
+        return os.path.join(destination, '.git', 'backup', 'chunk-tmp')
+
+    def _recover_interrupted_sync(self, destination, manifest):
+        """Fold a crashed sync's journal into the manifest and roll back its temp files; True if there was one."""
+        # Chunks half written when the sync died; whole ones are already in the store
+        shutil.rmtree(self._chunk_tmp_dir(destination), ignore_errors=True)
+        journal = SyncJournal(self._journal_path(destination))
+        if not journal.exists():
+            return False
+
+        rolled_back = 0
+        for op, rel_path, _ in journal.entries():
+            if op != 'plan':
+                continue
+            tmp_file = temp_sibling(os.path.join(destination, rel_path), 'tmp')
+            if os.path.lexists(tmp_file):
+                os.remove(tmp_file)
+                rolled_back += 1
+
+        recovered = 0
+        if manifest.load():
+            writer = manifest.writer()
+            try:
+                for rel_path, old, change in merge_sorted(manifest, journal.completed()):
+                    if change is None:
+                        writer.write(rel_path, old)
+                        continue
+                    op, record = change
+                    if op == 'done' and self._copy_landed(os.path.join(destination, rel_path), record):
+                        writer.write(rel_path, record)
+                        recovered += 1
+                    elif op == 'deleted':
+                        recovered += 1
+                    # Otherwise dropped, so the file is compared and copied again
+                writer.commit()
+            except BaseException:
+                writer.discard()
+                raise
+        journal.remove()
+        self.logger.warning(f"Resuming an interrupted sync: {recovered} finished operation(s) recovered, "
+                            f"{rolled_back} unfinished copy(ies) rolled back")
+        return True
+
+    def _copy_landed(self, dest_file, record):
+        """Whether dest_file is the complete copy described by a journaled manifest record."""
+        try:
+            st = os.stat(dest_file)
+        except OSError:
+            return False
+        if st.st_size == record[0] and st.st_mtime_ns == record[1]:
+            return True
+        pointer = read_chunk_pointer(dest_file) if self.chunk_threshold else None
+        return pointer is not None and pointer[0] == record[0]
+
+    def _reset_counts(self):
+        self.sync_counts = {'updated': 0, 'renamed': 0, 'deleted': 0, 'failed': 0}
+        self.sync_bytes = {'updated': 0, 'renamed': 0, 'deleted': 0}
+        self.sized_counts = {'updated': 0, 'renamed': 0, 'deleted': 0}  # Files whose size went into sync_bytes
+        self.changed_dirs = ChangeHistogram()
+
+    def _count_change(self, rel_path, status, size=None):
+        """Add one changed file to the running counters and the directory histogram."""
+        self.sync_counts[status] += 1
+        if size is not None and status in self.sync_bytes:
+            self.sync_bytes[status] += size
+            self.sized_counts[status] += 1
+        self.changed_dirs.add(rel_path)
+
+    def summary(self):
+        """Counts of the per-file results of the last sync or plan."""
+        return {**self.sync_counts,
+                'bytes_updated': self.sync_bytes['updated'],
+                'bytes_renamed': self.sync_bytes['renamed'],
+                'bytes_deleted': self.sync_bytes['deleted'],
+                'top_directories': dict(self.changed_dirs.top())}
+
+    def change_summary(self):
+        """Lines describing the last sync: counts, byte totals and the most changed directories."""
+        lines = []
+        for status in ('updated', 'renamed', 'deleted'):
+            count, sized = self.sync_counts[status], self.sized_counts[status]
+            if not count:
+                continue
+            line = f"Files {status}: {count}"
+            # Sizes are unknown for deletions without a manifest and for renames in direct staging
+            if sized:
+                line += f" ({'' if sized == count else 'at least '}{format_size(self.sync_bytes[status])})"
+            lines.append(line)
+        if self.sync_counts['failed']:
+            lines.append(f"Files failed: {self.sync_counts['failed']}")
+        top = self.changed_dirs.top()
+        if top and sum(self.sync_counts.values()) > 1:
+            lines.append("")
+            lines.append("Most changed directories:")
+            lines.extend(f"  {directory}: {count}" for directory, count in top)
+        return lines
+
+    def dry_run(self, on_change=None):
+        """Work out what the next backup would change without writing anything.
+
+        Returns the change counts; on_change(rel_path, status) receives each planned change.
+        """
+        git_dir = os.path.join(self.repo_path, '.git')
+        if self.direct_staging and os.path.isdir(git_dir):
+            self._reset_counts()
+            output = self._git('add', '-A', '--dry-run', staging=True).stdout
+            for line in output.splitlines():
+                action, _, rel_path = line.partition(' ')
+                status = 'deleted' if action == 'remove' else 'updated'
+                self._count_change(rel_path.strip("'"), status)
+                if on_change is not None:
+                    on_change(rel_path.strip("'"), status)
+        else:
+            self._sync_files(self.notes_path, self.repo_path, dry_run=True, on_change=on_change)
+        return self.summary()
+
+    def _object_store_stats(self):
+        """(loose objects, packs) of the mirror, read without running git.
+
+        Like gc --auto, loose objects are estimated from one of the 256 fan-out
+        directories rather than counted.
+        """
+        objects_dir = os.path.join(self.repo_path, '.git', 'objects')
+        try:
+            loose = len(os.listdir(os.path.join(objects_dir, '17'))) * 256
+        except OSError:
+            loose = 0
+        try:
+            packs = sum(1 for name in os.listdir(os.path.join(objects_dir, 'pack')) if name.endswith('.pack'))
+        except OSError:
+            packs = 0
+        return loose, packs
+
+    def maintenance_due(self, state=None):
+        """Whether the object store has grown enough for maintain() to be worth it."""
+        state = self._load_state() if state is None else state
+        if time.time() - state.get('maintenance', {}).get('at', 0) < MAINTENANCE_INTERVAL:
+            return False
+        loose, packs = self._object_store_stats()
+        return loose >= MAINTENANCE_LOOSE_OBJECTS or packs >= MAINTENANCE_PACK_LIMIT
+
+    def _measure_repository(self):
+        """Object store size and the time of the status call every backup makes."""
+        stats = dict(line.split(': ', 1) for line in self._git('count-objects', '-v').stdout.splitlines())
+        started = time.perf_counter()
+        self._git('status', '--porcelain=v2', '-z', '--untracked-files=no', staging=True)
+        return {'loose_objects': int(stats.get('count', 0)),
+                'loose_kib': int(stats.get('size', 0)),
+                'packs': int(stats.get('packs', 0)),
+                'pack_kib': int(stats.get('size-pack', 0)),
+                'status_seconds': round(time.perf_counter() - started, 4)}
+
+    def maintain(self, force=False):
+        """Repack and refresh the commit-graph and multi-pack-index when due.
+
+        Returns the maintenance record, None if nothing was due, False if git failed.
+        """
+        if not os.path.isdir(os.path.join(self.repo_path, '.git')):
+            return None
+        state = self._load_state()
+        if not force and not self.maintenance_due(state):
+            return None
+
+        self.git_calls = []
+        steps = {}
+
+        def step(name, *args):
+            started = time.perf_counter()
+            result = self._git(*args, check=False)
+            steps[name] = round(time.perf_counter() - started, 4)
+            if result.returncode != 0:
+                self.logger.warning(f"Maintenance step {name} failed: {result.stderr.strip()}")
+            return result.returncode == 0
+
+        try:
+            signature = self._git_state_signature()
+            before = self._measure_repository()
+            if before['loose_objects']:
+                # Incremental: loose objects into one new pack, existing packs untouched
+                step('repack', 'repack', '-d', '-q')
+            if before['packs'] + 1 >= MAINTENANCE_PACK_LIMIT:
+                # Merge small packs so their sizes grow geometrically, instead of one full repack
+                step('geometric-repack', 'repack', '-d', '-q', '--geometric=2')
+            step('multi-pack-index', 'multi-pack-index', 'write')
+            step('commit-graph', 'commit-graph', 'write', '--reachable', '--split', '--size-multiple=2')
+            after = self._measure_repository()
+        except subprocess.CalledProcessError as e:
+            self.logger.error(f"Maintenance failed: {e.stderr.strip() or e}")
+            return False
+        finally:
+            self._log_git_calls()
+
+        record = {'at': round(time.time()), 'before': before, 'after': after, 'seconds': steps}
+        state['maintenance'] = record
+        if state.get('git') == signature:
+            state['git'] = self._git_state_signature()  # status may have refreshed the index
+        self._save_state(state)
+        self.logger.info(f"Maintenance: {before['loose_objects']} -> {after['loose_objects']} loose objects, "
+                         f"{before['packs']} -> {after['packs']} packs, status "
+                         f"{before['status_seconds']:.3f}s -> {after['status_seconds']:.3f}s")
+        return record
+
+    def status(self):
+        """Describe the mirror repository without changing it."""
+        info = {
+            'notes_path': self.notes_path,
+            'repo_path': self.repo_path,
+            'branch': self.branch,
+            'initialized': os.path.isdir(os.path.join(self.repo_path, '.git')),
+        }
+        manifest = SyncManifest(self._manifest_path(self.repo_path))
+        info['manifest_entries'] = manifest.count() if manifest.load() else None
+        if not info['initialized']:
+            return info
+        state = self._load_state()
+        info['runs'] = state.get('runs', 0)
+        info['fast_path_hits'] = state.get('fast_path_hits', 0)
+        info['pending_push'] = state.get('pending_push', {})
+        info['maintenance'] = state.get('maintenance')
+        info['performance_profile'] = self._profile_settings()
+
+        def git(*args):
+            result = self._git(*args, check=False)
+            return result.stdout.strip() if result.returncode == 0 else None
+
+        info['head'] = git('rev-parse', '--verify', '--quiet', 'HEAD')
+        info['last_commit'] = git('log', '-1', '--format=%cI %s')
+        unpushed = git('rev-list', '--count', f'origin/{self.branch}..HEAD')
+        info['unpushed_commits'] = int(unpushed) if unpushed is not None else None
+        return info
+
+    def watch(self, debounce=2.0, poll_interval=2.0, stop_event=None):
+        """Back up continuously, handing only the changed paths to each backup run.
+
+        Uses inotify on Linux and polling elsewhere. Runs until stop_event is set,
+        then returns {'ok': whether the last backup succeeded, 'runs', 'failed'}.
+        """
+        stop_event = stop_event or threading.Event()
+        watcher = create_watcher(self.notes_path, poll_interval, self._ignore_rules())
+        self.logger.info(f"Watching {self.notes_path} for changes ({watcher.kind})")
+        result = {'ok': True, 'runs': 0, 'failed': 0}
+
+        def run(paths=None):
+            result['ok'] = self.backup(paths=paths)
+            result['runs'] += 1
+            result['failed'] += not result['ok']
 
-            # Remove deleted files
-            for rel_path in dest_files - source_files:
-                if not rel_path.startswith('.git'):  # Skip .git files
+        try:
+            # Start from a full backup; events from here on are already being queued
+            run()
+            while not stop_event.is_set():
+                self.maintain()  # Idle between backups; returns at once unless the object store has grown
+                dirty = watcher.wait_for_changes(debounce, stop_event)
+                if stop_event.is_set():
+                    break
+                if dirty is None:
+                    self.logger.warning("Watcher lost track of changes, running a full backup")
+                    run()
+                elif dirty:
+                    self.logger.info(f"Detected {len(dirty)} changed path(s)")
+                    run(dirty)
+        finally:
+            watcher.close()
+            self.flush()  # Whatever the push policy held back
+            self.close_ssh_master()
+            self.stop_fsmonitor()
+            self.logger.info("Stopped watching")
+        return result
+
+    def _sync_files(self, source, destination, paths=None, dry_run=False, on_change=None):
+        """Sync source into destination, merge-joining the walk with the manifest in path order.
+
+        paths limits the walk to what watch mode reported; on_change(rel_path, status) sees every change.
+        """
+        writer = None
+        journal = None
+        try:
+            self._reset_counts()
+
+            # Ensure destination directory exists
+            if not dry_run:
+                os.makedirs(destination, exist_ok=True)
+
+            manifest = SyncManifest(self._manifest_path(destination))
+            if not dry_run and self._recover_interrupted_sync(destination, manifest):
+                paths = None  # The rest of the interrupted sync may lie outside the watched paths
+            trusted = manifest.load()
+            if trusted:
+                recorded = manifest
+            else:
+                self.logger.info("No sync manifest found, comparing against destination tree")
+                paths = None
+                recorded = ((rel_path, None) for rel_path, _ in self._scan_mirror(destination)) \
+                    if os.path.isdir(destination) else ()
+            if not dry_run:
+                writer = manifest.writer()
+                journal = SyncJournal(self._journal_path(destination)).open()
+
+            # Results queued in path order: finished tuples and copies still on the pool
+            window = deque()
+            limit = self.copy_workers * 16
+            last_dir = None
+            # Files that vanished or appeared since the manifest, paired up as moves after the walk
+            vanished = {}
+            held_vanished = 0
+            appeared = []
+
+            with ThreadPoolExecutor(max_workers=self.copy_workers) as pool:
+                listing = merge_sorted(self._scan_source(source, paths), recorded)
+                for rel_path, entry, old in self._timed(listing, 'walk'):
+                    if entry is None:
+                        if paths is not None and not self._in_scope(rel_path, paths):
+                            window.append((rel_path, 'unchanged', old))  # Outside the watched paths
+                        elif trusted and not rel_path.startswith('.git') and held_vanished < MOVE_DETECTION_LIMIT:
+                            key = (old[2], old[0], old[1])  # Inode, size and mtime survive a rename
+                            vanished.setdefault(key, []).append((rel_path, old))
+                            held_vanished += 1
+                        elif not rel_path.startswith('.git'):  # Skip .git files
+                            # Let in-flight copies land before any directory is pruned under them
+                            self._flush_window(window, writer, on_change, keep=0, journal=journal)
+                            last_dir = None
+                            with self.report.span('delete'):
+                                window.append(self._remove_stale(destination, rel_path, old, dry_run))
+                        continue
+
+                    self.report.count('files_examined')
                     try:
-                        file_to_delete = os.path.join(destination, rel_path)
-                        if os.path.exists(file_to_delete):
-                            os.remove(file_to_delete)
-                            self.backup_status[rel_path] = 'deleted'
-                            self.logger.info(f"Deleted: {rel_path}")
-                    except Exception as e:
-                        self.logger.error(f"Failed to delete {rel_path}: {e}")
-
-            # Remove empty directories
-            for root, dirs, _ in os.walk(destination, topdown=False):
-                for dir_name in dirs:
-                    dir_path = os.path.join(root, dir_name)
-                    if '.git' not in dir_path and not os.listdir(dir_path):
-                        os.rmdir(dir_path)
-                        self.logger.info(f"Removed empty directory: {dir_path}")
+                        st = entry.stat()
+                    except OSError as e:
+                        self.logger.error(f"Failed to copy {rel_path}: {e}")
+                        window.append((rel_path, 'failed', None))
+                        continue
+
+                    signature = (st.st_size, st.st_mtime_ns, st.st_ino)
+                    if trusted and old is not None and tuple(old[:3]) == signature:
+                        window.append((rel_path, 'unchanged', old))
+                    elif trusted and old is None and len(appeared) < MOVE_DETECTION_LIMIT:
+                        appeared.append((rel_path, entry.path, st))
+                        continue
+                    else:
+                        dest_file = os.path.join(destination, rel_path)
+                        dest_dir = os.path.dirname(dest_file)
+                        if not dry_run and dest_dir != last_dir:
+                            try:
+                                os.makedirs(dest_dir, exist_ok=True)
+                                last_dir = dest_dir
+                            except OSError:
+                                pass  # Reported by the copy itself
+                        if journal is not None:
+                            journal.planned(rel_path)
+                        window.append(pool.submit(self._sync_one, rel_path, entry.path, dest_file,
+                                                  st, old, trusted, dry_run))
+                    self._flush_window(window, writer, on_change, keep=limit, journal=journal)
+
+                self._flush_window(window, writer, on_change, keep=0, journal=journal)
+
+                if vanished or appeared:
+                    if writer is not None:
+                        writer.defer()
+                        journal.start_run()
+                    self._settle_moves(destination, vanished, appeared, window, pool, dry_run, journal)
+                    self._flush_window(window, writer, on_change, keep=0, journal=journal)
+
+            if writer is not None:
+                writer.commit()
+                journal.remove()  # The manifest now covers everything the journal did
 
         except Exception as e:
+            if writer is not None:
+                writer.discard()
+            if journal is not None:
+                journal.close()  # Kept, the next sync resumes from it
             self.logger.error(f"Sync error: {e}")
             raise
+        finally:
+            self._close_chunk_pool()
+
+    def _timed(self, iterable, phase):
+        """Iterate, charging the time spent producing each item to a report phase."""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            item = next(iterator, None)
+            self.report.add(phase, time.perf_counter() - started)
+            if item is None:
+                return
+            yield item
+
+    def _flush_window(self, window, writer, on_change, keep=None, journal=None):
+        """Settle results from the head of the window, in path order.
+
+        Finished results are always taken; with keep, also waits on unfinished
+        copies until no more than keep entries are left. Updates and deletions
+        are logged to journal as they settle.
+        """
+        while window:
+            head = window[0]
+            if isinstance(head, Future) and not head.done() and (keep is None or len(window) <= keep):
+                break
+            window.popleft()
+            rel_path, status, record = head.result() if isinstance(head, Future) else head
+            if record is not None and writer is not None and status != 'deleted':
+                writer.write(rel_path, record)
+            if journal is not None and status != 'unchanged' and status != 'failed':
+                journal.done(rel_path, record) if record is not None and status != 'deleted' \
+                    else journal.deleted(rel_path)
+            if status != 'unchanged':
+                if status != 'renamed-from':  # Counted once, as the 'renamed' half of the move
+                    self._count_change(rel_path, status, record[0] if record else None)
+                if on_change is not None:
+                    on_change(rel_path, status)
+
+    def _settle_moves(self, destination, vanished, appeared, window, pool, dry_run, journal):
+        """Rename files that moved inside the mirror; copy or delete the rest, queued in path order."""
+        moves, copies = [], []
+        for rel_path, src_file, st in appeared:
+            candidates = vanished.get((st.st_ino, st.st_size, st.st_mtime_ns))
+            if candidates:
+                old_path, old = candidates.pop()
+                moves.append((old_path, rel_path, (st.st_size, st.st_mtime_ns, st.st_ino, old[3])))
+            else:
+                copies.append((rel_path, src_file, st))
+
+        if self.content_hash and copies:
+            # Copied rather than moved (new inode), but the mirror may already hold the bytes
+            by_digest = {}
+            for candidates in vanished.values():
+                for old_path, old in candidates:
+                    if old[3]:
+                        by_digest.setdefault((old[0], old[3]), []).append(old_path)
+            sizes = {size for size, _ in by_digest}
+            unmatched = []
+            for rel_path, src_file, st in copies:
+                if st.st_size in sizes:
+                    try:
+                        digest = git_blob_sha1(src_file, st.st_size)
+                    except OSError:
+                        digest = None
+                    candidates = by_digest.get((st.st_size, digest))
+                    if candidates:
+                        moves.append((candidates.pop(), rel_path, (st.st_size, st.st_mtime_ns, st.st_ino, digest)))
+                        continue
+                unmatched.append((rel_path, src_file, st))
+            copies = unmatched
+
+        # Collected as (rel_path, result) and queued in path order, the order the journal needs
+        results = []
+        moved = set()
+        with self.report.span('move'):
+            for old_path, new_path, record in moves:
+                moved_pair = self._move_one(destination, old_path, new_path, record, dry_run)
+                if moved_pair is None:
+                    copies.append((new_path, os.path.join(self.notes_path, new_path), None))
+                    continue
+                moved.add(old_path)
+                results.extend((result[0], result) for result in moved_pair)
+
+        # Deletions before copies, so no directory is pruned under a copy in flight
+        with self.report.span('delete'):
+            for candidates in vanished.values():
+                for old_path, old in candidates:
+                    if old_path not in moved:
+                        results.append((old_path, self._remove_stale(destination, old_path, old, dry_run)))
+
+        for rel_path, src_file, st in copies:
+            try:
+                st = st or os.stat(src_file)
+            except OSError as e:
+                self.logger.error(f"Failed to copy {rel_path}: {e}")
+                results.append((rel_path, (rel_path, 'failed', None)))
+                continue
+            dest_file = os.path.join(destination, rel_path)
+            if not dry_run:
+                try:
+                    os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+                except OSError:
+                    pass  # Reported by the copy itself
+            if journal is not None:
+                journal.planned(rel_path)
+            results.append((rel_path, pool.submit(self._sync_one, rel_path, src_file, dest_file,
+                                                  st, None, True, dry_run)))
+
+        results.sort(key=lambda item: item[0])
+        window.extend(result for _, result in results)
+
+    def _move_one(self, destination, old_path, new_path, record, dry_run):
+        """Follow a source rename inside the mirror; returns window results, None if it failed."""
+        if not dry_run:
+            new_file = os.path.join(destination, new_path)
+            try:
+                os.makedirs(os.path.dirname(new_file), exist_ok=True)
+                os.replace(os.path.join(destination, old_path), new_file)
+            except OSError as e:
+                self.logger.warning(f"Could not move {old_path} to {new_path} in the mirror, copying instead: {e}")
+                return None
+            self._remove_empty_parents(destination, old_path)
+            self.logger.info(f"Renamed: {old_path} -> {new_path}")
+        return [(old_path, 'renamed-from', None), (new_path, 'renamed', record)]
+
+    def _remove_stale(self, destination, rel_path, old, dry_run):
+        """Delete a file that vanished from the source; returns its window result."""
+        if dry_run:
+            return rel_path, 'deleted', old
+        try:
+            file_to_delete = os.path.join(destination, rel_path)
+            if not os.path.lexists(file_to_delete):
+                return rel_path, 'unchanged', None
+            os.remove(file_to_delete)
+            self.logger.info(f"Deleted: {rel_path}")
+            self._remove_empty_parents(destination, rel_path)
+            return rel_path, 'deleted', old  # Not written to the manifest, only sized
+        except Exception as e:
+            self.logger.error(f"Failed to delete {rel_path}: {e}")
+            return rel_path, 'unchanged', old  # Keep tracking it so the next run retries
+
+    def _scan_source(self, source, paths):
+        """Yield source files to examine: the whole tree, or just the given paths."""
+        ignore = self._ignore_rules()
+        if paths is None:
+            yield from scan_tree(source, ignore)
+            return
+        def key(rel_path):
+            # Same order as a full walk, which lists a directory's files under 'name/'
+            return rel_path + os.sep if os.path.isdir(os.path.join(source, rel_path)) else rel_path
+
+        for rel_path in sorted(paths, key=key):
+            parent = os.path.dirname(rel_path)
+            while parent and parent not in paths:
+                parent = os.path.dirname(parent)
+            if parent:
+                continue  # Covered by the scan of an enclosing directory
+            full_path = os.path.join(source, rel_path)
+            if os.path.isdir(full_path) and not os.path.islink(full_path):
+                if not ignore.excluded(rel_path, True):
+                    yield from scan_tree(source, ignore, start=rel_path)
+            elif os.path.isfile(full_path) and not ignore.excluded(rel_path, False):
+                yield rel_path, _FileEntry(full_path)
+
+    def _in_scope(self, rel_path, paths):
+        """Whether rel_path is one of the given paths or lies below one of them."""
+        while rel_path:
+            if rel_path in paths:
+                return True
+            rel_path = os.path.dirname(rel_path)
+        return False
+
+    def _sync_one(self, rel_path, src_file, dest_file, st, old, trusted, dry_run=False):
+        """Copy one changed file into the mirror; runs on the copy pool."""
+        try:
+            signature = (st.st_size, st.st_mtime_ns, st.st_ino)
+            if trusted:
+                changed = True
+            else:
+                changed = not os.path.exists(dest_file) or \
+                          st.st_mtime > os.path.getmtime(dest_file) or \
+                          st.st_size != os.path.getsize(dest_file)
+
+            digest = None
+            if changed and self.content_hash:
+                # Only re-read files whose size or mtime moved; skip copies of identical bytes
+                digest = git_blob_sha1(src_file, st.st_size)
+                changed = digest != self._mirrored_digest(dest_file, st.st_size, old, trusted)
+
+            if not changed:
+                return rel_path, 'unchanged', (*signature, digest)
+            if dry_run:
+                return rel_path, 'updated', (*signature, digest)  # Only sized, dry runs write no manifest
+
+            started = time.perf_counter()
+            if self.chunk_threshold and st.st_size >= self.chunk_threshold:
+                new_chunks, total = self._store_chunked(src_file, dest_file)
+                self.logger.info(f"Updated: {rel_path} ({new_chunks} new of {total} chunks)")
+            else:
+                self._copy_file(src_file, dest_file)
+                self.logger.info(f"Updated: {rel_path}")
+            self.report.add('copy', time.perf_counter() - started)
+            self.report.count('bytes_copied', st.st_size)
+            return rel_path, 'updated', (*signature, digest)
+        except Exception as e:
+            self.logger.error(f"Failed to copy {rel_path}: {e}")
+            return rel_path, 'failed', None
+
+    def _copy_file(self, src_file, dest_file):
+        """Materialize src_file at dest_file according to copy_mode.
+
+        The data is written to a hidden sibling and renamed into place, so an
+        interrupted copy never leaves a truncated file at dest_file.
+        """
+        tmp_file = temp_sibling(dest_file, 'tmp')
+        try:
+            if self.copy_mode == 'hardlink':
+                try:
+                    if os.path.exists(dest_file) and os.path.samefile(src_file, dest_file):
+                        return  # Already linked; rename() would be a no-op between the two names
+                    os.link(src_file, tmp_file)
+                    os.replace(tmp_file, dest_file)
+                    return
+                except OSError:
+                    # Different filesystem or no hardlink support, clone instead
+                    if os.path.lexists(tmp_file):
+                        os.remove(tmp_file)
+
+            if self.copy_mode == 'copy':
+                shutil.copy2(src_file, tmp_file)
+            else:
+                clone_file(src_file, tmp_file)
+            os.replace(tmp_file, dest_file)
+        except BaseException:
+            if os.path.lexists(tmp_file):
+                os.remove(tmp_file)
+            raise
+
+    def _store_chunked(self, src_file, dest_file):
+        """Write src_file's new chunks to the chunk store and a pointer at dest_file.
+
+        Chunks already in the store are skipped, so git only ever sees (and pushes)
+        the chunks an edit actually touched. Returns (new chunks, total chunks).
+        """
+        chunk_root = os.path.join(self.repo_path, CHUNK_DIR)
+        # Staged outside the work tree: 'git add -f' would pick up a partial chunk
+        tmp_dir = self._chunk_tmp_dir(self.repo_path)
+        digest = hashlib.sha256()
+        lines = []
+        new_chunks = 0
+        size = 0
+        for data in self._read_chunks(src_file):
+            chunk_id = hashlib.sha256(data).hexdigest()
+            digest.update(data)
+            size += len(data)
+            lines.append(f"{chunk_id} {len(data)}\n")
+            chunk_path = os.path.join(chunk_root, chunk_id[:2], chunk_id)
+            if not os.path.exists(chunk_path):
+                os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+                os.makedirs(tmp_dir, exist_ok=True)
+                tmp_path = os.path.join(tmp_dir, f'{threading.get_ident()}.tmp')
+                try:
+                    with open(tmp_path, 'wb') as f:
+                        f.write(data)
+                    os.replace(tmp_path, chunk_path)
+                except BaseException:
+                    if os.path.lexists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+                new_chunks += 1
+
+        # Replace rather than rewrite, dest_file may be a hardlink to the source
+        tmp_path = temp_sibling(dest_file, 'tmp')
+        try:
+            with open(tmp_path, 'w', encoding='ascii') as f:
+                f.write(f"{CHUNK_POINTER_MAGIC}\nsize {size}\nsha256 {digest.hexdigest()}\n")
+                f.writelines(lines)
+            os.replace(tmp_path, dest_file)
+        except BaseException:
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return new_chunks, len(lines)
+
+    def _read_chunks(self, src_file):
+        """Yield src_file's chunks, with the boundaries found in a worker process."""
+        try:
+            with self._chunk_pool_lock:
+                if self._chunk_pool is None:
+                    self._chunk_pool = ProcessPoolExecutor(max_workers=min(self.copy_workers, os.cpu_count() or 1))
+                pool = self._chunk_pool
+            lengths = pool.submit(chunk_lengths, src_file).result()
+        except (BrokenExecutor, NotImplementedError) as e:  # No worker processes on this platform
+            self.logger.warning(f"Finding chunk boundaries in the copy thread: {e}")
+            yield from content_chunks(src_file)
+            return
+        with open(src_file, 'rb') as f:
+            for length in lengths:
+                data = f.read(length)
+                if not data:
+                    return
+                yield data
+
+    def _close_chunk_pool(self):
+        with self._chunk_pool_lock:
+            if self._chunk_pool is not None:
+                self._chunk_pool.shutdown()
+                self._chunk_pool = None
+
+    def restore(self, rel_path, output_path):
+        """Copy a backed-up file out of the mirror, reassembling it if it was chunked."""
+        mirrored = os.path.join(self.repo_path, rel_path)
+        if read_chunk_pointer(mirrored) is not None:
+            restore_chunked(mirrored, os.path.join(self.repo_path, CHUNK_DIR), output_path)
+        else:
+            shutil.copy2(mirrored, output_path)
+
+    def _mirrored_digest(self, dest_file, size, old, trusted):
+        """Blob id of the mirrored copy, from the manifest or by hashing the destination."""
+        if trusted:
+            return old[3] if old else None
+        try:
+            if os.path.getsize(dest_file) == size:
+                return git_blob_sha1(dest_file, size)
+        except OSError:
+            pass
+        return None
+
+    def _scan_mirror(self, destination):
+        """Walk the mirror, skipping .git directories (and submodule .git files) and the chunk store."""
+        for rel_path, entry in scan_tree(destination, IgnoreRules(['.git', f'/{CHUNK_DIR}/'])):
+            yield rel_path, entry
+
+    def _remove_empty_parents(self, destination, rel_path):
+        """Remove directories left empty by a deletion, walking up to the mirror root."""
+        parent = os.path.dirname(rel_path)
+        while parent:
+            dir_path = os.path.join(destination, parent)
+            try:
+                os.rmdir(dir_path)
+            except OSError:
+                break  # Not empty (or already gone)
+            self.logger.info(f"Removed empty directory: {dir_path}")
+            parent = os.path.dirname(parent)
 
     def _generate_commit_message(self):
-        """Generate detailed commit message including deletions."""
+        """Generate detailed commit message including deletions, from the running counters."""
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        updated_files = len([f for f, status in self.backup_status.items() if status == 'updated'])
-        deleted_files = len([f for f, status in self.backup_status.items() if status == 'deleted'])
-        failed_files = len([f for f, status in self.backup_status.items() if status == 'failed'])
-
         msg = f"Backup: {timestamp}\n\n"
-        if updated_files > 0:
-            msg += f"Files updated: {updated_files}\n"
-        if deleted_files > 0:
-            msg += f"Files deleted: {deleted_files}\n"
-        if failed_files > 0:
-            msg += f"Files failed: {failed_files}\n"
+        for line in self.change_summary():
+            msg += f"{line}\n"
         return msg
 
     def handle_git_pull(self):
         """Enhanced git pull handling."""
         try:
-            subprocess.run(['git', 'fetch', 'origin'], check=True)
-            subprocess.run(['git', 'pull', '--no-rebase'], check=True)
+            self._fetch_branch()
+            self._git('merge', '--no-edit', f'origin/{self.branch}')
+            self._forget_tracked_ignored()
             return True
         except subprocess.CalledProcessError as e:
-            if "CONFLICT" in subprocess.run(['git', 'status'], capture_output=True, text=True).stdout:
+            if "CONFLICT" in e.stdout:
                 self.logger.error("Merge conflicts detected")
                 self._handle_conflicts()
                 return False
@@ -592,30 +2819,135 @@ class SSHGitBackup:
         """Handle merge conflicts."""
         try:
             # Create backup of conflicted files
-            status = subprocess.run(['git', 'status', '--porcelain'], capture_output=True, text=True)
-            for line in status.stdout.splitlines():
-                if line.startswith('UU'):
-                    file_path = line[3:].strip()
+            status = self._git('status', '--porcelain=v2', '-z')
+            for xy, file_path in parse_status_v2(status.stdout):
+                if xy == 'UU':
                     backup_path = f"{file_path}.backup"
-                    shutil.copy2(file_path, backup_path)
+                    shutil.copy2(os.path.join(self.repo_path, file_path),
+                                 os.path.join(self.repo_path, backup_path))
                     self.logger.info(f"Created backup of conflicted file: {backup_path}")
 
             # Reset to pre-conflict state
-            subprocess.run(['git', 'reset', '--hard', 'HEAD'], check=True)
+            self._git('reset', '--hard', 'HEAD')
+            SyncManifest(self._manifest_path(self.repo_path)).invalidate()
             self.logger.info("Reset to pre-conflict state")
         except Exception as e:
             self.logger.error(f"Error handling conflicts: {e}")
 
+class BackupScheduler:
+    """Run several SSHGitBackup jobs concurrently on a worker pool.
+
+    Local work (scan, copy, add, commit) runs fully in parallel; network
+    operations are limited to per_remote_limit at a time per remote host.
+    """
+
+    def __init__(self, jobs, max_workers=4, per_remote_limit=2):
+        self.jobs = list(jobs)
+        self.max_workers = max(1, max_workers)
+        self.per_remote_limit = max(1, per_remote_limit)
+        self.logger = logging.getLogger(__name__)
+
+        mirrors = [job.repo_path for job in self.jobs]
+        duplicates = {path for path in mirrors if mirrors.count(path) > 1}
+        if duplicates:
+            raise ValueError(f"Jobs share a mirror directory, set mirror_dir: {', '.join(sorted(duplicates))}")
+
+    @staticmethod
+    def remote_host(job):
+        """Host a job pushes to, used to group jobs under one concurrency limit."""
+        if job.is_ssh:
+            return job._ssh_target()[0].rpartition('@')[2]
+        match = re.match(r'^[a-z][a-z0-9+.-]*://(?:[^@/]*@)?([^/]+)', job.repo_url)
+        return match.group(1) if match else 'local'
+
+    def run(self):
+        """Back up every job; returns {repo_path: success}."""
+        slots = {}
+        for job in self.jobs:
+            host = self.remote_host(job)
+            if host not in slots:
+                slots[host] = threading.BoundedSemaphore(self.per_remote_limit)
+            job.remote_slot = slots[host]
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(job.backup): job for job in self.jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    results[job.repo_path] = future.result()
+                except Exception as e:
+                    self.logger.error(f"Backup of {job.notes_path} crashed: {e}")
+                    results[job.repo_path] = False
+                self.logger.info(f"Backup of {job.notes_path} -> {job.repo_path}: "
+                                 f"{'ok' if results[job.repo_path] else 'failed'}")
+        return results
+
+
 # BackupApp s and other UI methods...
 
+class QueueLogHandler(logging.Handler):
+    """Hands formatted log lines to the GUI thread through a queue.
+
+    Once limit lines are waiting, records below WARNING are dropped (and counted)
+    instead of queued, so a flood of per-file lines can never pile up unbounded.
+    """
+
+    def __init__(self, log_queue, limit):
+        super().__init__()
+        self.log_queue = log_queue
+        self.limit = limit
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            if record.levelno < logging.WARNING and self.log_queue.qsize() >= self.limit:
+                self.dropped += 1
+                return
+            self.log_queue.put_nowait(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def take_dropped(self):
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+def _load_gui():
+    """Import tkinter on demand so the CLI works on machines without a display."""
+    global tk, ttk, filedialog, messagebox, scrolledtext
+    if tk is None:
+        import tkinter
+        from tkinter import filedialog as _filedialog, messagebox as _messagebox
+        from tkinter import scrolledtext as _scrolledtext, ttk as _ttk
+        tk, ttk, filedialog, messagebox, scrolledtext = \
+            tkinter, _ttk, _filedialog, _messagebox, _scrolledtext
+
 class BackupApp:
+    LOG_QUEUE_LIMIT = 10000  # Lines waiting for the pump before INFO records are dropped
+    LOG_BATCH = 500  # Lines inserted per pump tick
+    LOG_MAX_LINES = 2000  # Older lines are trimmed from the status box
+    PUMP_INTERVAL_MS = 100
+
     def __init__(self, root):
+            _load_gui()
             self.root = root
             self.root.title("Git Backup Tool")
             self.root.geometry("800x600")
             self.create_widgets()
             self.backup_thread = None
             self.is_backing_up = False
+            self.watch_stop = None
+            self.active_backup = None
+
+            # Worker threads never touch widgets; log lines, status messages and UI
+            # callbacks all go through this queue and are applied by _pump()
+            self.log_queue = queue.Queue()
+            self.log_handler = QueueLogHandler(self.log_queue, self.LOG_QUEUE_LIMIT)
+            self.log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s: %(message)s',
+                                                            datefmt='%H:%M:%S'))
+            logging.getLogger(__name__).addHandler(self.log_handler)
+            self.root.after(self.PUMP_INTERVAL_MS, self._pump)
 
     def create_widgets(self):
         # Main container with padding
@@ -655,10 +2987,25 @@ class BackupApp:
         # Branch entry
         self._create_branch_entry(settings_frame, "Branch:", 2)
 
+        # Nested repositories to back up as submodules
+        self._create_submodules_entry(settings_frame, "Submodules:", 3)
+
         # Backup button
         self.backup_button = ttk.Button(main_frame, text="Start Backup", command=self.start_backup)
         self.backup_button.pack(pady=10)
 
+        # Watch button
+        self.watch_button = ttk.Button(main_frame, text="Start Watching", command=self.toggle_watch)
+        self.watch_button.pack(pady=(0, 10))
+
+        # Progress of the running backup
+        progress_frame = ttk.Frame(main_frame)
+        progress_frame.pack(fill=tk.X, padx=5)
+        self.progress_bar = ttk.Progressbar(progress_frame, mode='determinate')
+        self.progress_bar.pack(fill=tk.X)
+        self.progress_var = tk.StringVar(value="")
+        ttk.Label(progress_frame, textvariable=self.progress_var).pack(anchor=tk.W)
+
         # Status text box
         self.status_text = scrolledtext.ScrolledText(main_frame, height=10, wrap=tk.WORD, state=tk.DISABLED)
         self.status_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
@@ -692,6 +3039,14 @@ class BackupApp:
         self.branch_entry = ttk.Entry(parent, width=50)
         self.branch_entry.grid(row=row, column=1, padx=5, pady=5)
 
+    def _create_submodules_entry(self, parent, label_text, row):
+        label = ttk.Label(parent, text=label_text)
+        label.grid(row=row, column=0, sticky=tk.W, padx=5, pady=5)
+        self.submodules_entry = ttk.Entry(parent, width=50)
+        self.submodules_entry.grid(row=row, column=1, padx=5, pady=5)
+        hint = ttk.Label(parent, text="Paths inside the notes folder, comma separated")
+        hint.grid(row=row + 1, column=1, sticky=tk.W, padx=5)
+
     def browse_notes_path(self):
         path = filedialog.askdirectory()
         if path:
@@ -739,42 +3094,333 @@ class BackupApp:
                 messagebox.showinfo("Backup In Progress", "A backup is already in progress.")
                 return
 
+            backup = self._create_backup()
+
+            self.is_backing_up = True
+            self.active_backup = backup
+            self.update_status("Starting backup...")
+
+            self.backup_thread = threading.Thread(target=self.run_backup, args=(backup,))
+            self.backup_thread.start()
+
+    def _create_backup(self):
             # Gather input values
             notes_path = self.notes_path_entry.get()
             repo_url = self.repo_url_entry.get()
             branch = self.branch_entry.get() or 'main'
+            submodules = [path.strip() for path in self.submodules_entry.get().split(',') if path.strip()]
 
             # Get authentication details based on selected method
             if self.auth_var.get() == "ssh":
                 ssh_key_path = self.ssh_key_entry.get()
-                backup = SSHGitBackup(notes_path, repo_url, ssh_key_path=ssh_key_path, branch=branch)
-            else:
-                username = self.username_entry.get()
-                password = self.password_entry.get()
-                backup = SSHGitBackup(notes_path, repo_url, username=username, password=password, branch=branch)
+                return SSHGitBackup(notes_path, repo_url, ssh_key_path=ssh_key_path, branch=branch,
+                                    submodules=submodules, confirm_force_push=self.confirm_force_push)
+            username = self.username_entry.get()
+            password = self.password_entry.get()
+            return SSHGitBackup(notes_path, repo_url, username=username, password=password, branch=branch,
+                                submodules=submodules, confirm_force_push=self.confirm_force_push)
+
+    def confirm_force_push(self):
+        """Ask on the Tk thread; the backup thread calling this waits for the answer."""
+        answer = queue.Queue(maxsize=1)
+        self.log_queue.put(lambda: answer.put(messagebox.askyesno(
+            "Push Failed",
+            "Normal push failed. Would you like to force push? "
+            "This will overwrite remote changes!"
+        )))
+        return answer.get()
+
+    def toggle_watch(self):
+            if self.watch_stop is not None:
+                self.watch_stop.set()
+                self.watch_stop = None
+                self.watch_button.config(text="Start Watching")
+                self.update_status("Stopping watch mode...")
+                return
 
-            self.is_backing_up = True
-            self.update_status("Starting backup...")
+            if self.is_backing_up:
+                messagebox.showinfo("Backup In Progress", "A backup is already in progress.")
+                return
 
-            self.backup_thread = threading.Thread(target=self.run_backup, args=(backup,))
+            backup = self._create_backup()
+            self.active_backup = backup
+            self.watch_stop = threading.Event()
+            self.watch_button.config(text="Stop Watching")
+            self.backup_button.config(state=tk.DISABLED)
+            self.update_status("Watching for changes...")
+
+            self.backup_thread = threading.Thread(target=self.run_watch, args=(backup, self.watch_stop), daemon=True)
             self.backup_thread.start()
 
+    def run_watch(self, backup, stop_event):
+        backup.watch(stop_event=stop_event)
+        self.active_backup = None
+        self.log_queue.put(lambda: self.backup_button.config(state=tk.NORMAL))
+        self.update_status("Watch mode stopped.")
+
     def run_backup(self, backup):
         success = backup.backup()
+        backup.stop_fsmonitor()
         self.is_backing_up = False
+        self.active_backup = None
         if success:
+            for line in backup.change_summary():
+                self.update_status(line)
             self.update_status("Backup completed successfully.")
         else:
             self.update_status("Backup failed. Check the logs for more details.")
 
     def update_status(self, message):
+        """Queue a message for the status box; safe to call from any thread."""
+        self.log_queue.put(message)
+
+    def _pump(self):
+        """Move a batch of queued lines into the status box and refresh the progress bar."""
+        lines = []
+        try:
+            for _ in range(self.LOG_BATCH):
+                item = self.log_queue.get_nowait()
+                if callable(item):
+                    item()
+                else:
+                    lines.append(item)
+        except queue.Empty:
+            pass
+        dropped = self.log_handler.take_dropped()
+        if dropped:
+            lines.append(f"... {dropped} log line(s) skipped")
+        if lines:
+            self._append_lines(lines)
+        self._update_progress()
+        self.root.after(self.PUMP_INTERVAL_MS, self._pump)
+
+    def _append_lines(self, lines):
         self.status_text.config(state=tk.NORMAL)
-        self.status_text.insert(tk.END, f"{message}\n")
+        self.status_text.insert(tk.END, '\n'.join(lines) + '\n')
+        line_count = int(self.status_text.index('end-1c').split('.')[0])
+        if line_count > self.LOG_MAX_LINES:
+            self.status_text.delete('1.0', f'{line_count - self.LOG_MAX_LINES}.0')
         self.status_text.yview(tk.END)
         self.status_text.config(state=tk.DISABLED)
 
-# Running the application
-if __name__ == "__main__":
+    def _update_progress(self):
+        backup = self.active_backup
+        if backup is None:
+            self.progress_bar.config(mode='determinate', value=0)
+            return
+        done, expected = backup.progress()
+        if expected:
+            self.progress_bar.config(mode='determinate', maximum=max(expected, done, 1), value=done)
+        else:
+            self.progress_bar.config(mode='indeterminate')
+            self.progress_bar.step(2)
+        counts = backup.summary()
+        self.progress_var.set(f"{done} files checked, {counts['updated']} updated, "
+                              f"{counts['renamed']} renamed, {counts['deleted']} deleted, "
+                              f"{counts['failed']} failed")
+
+def run_gui():
+    _load_gui()
     root = tk.Tk()
     app = BackupApp(root)
     root.mainloop()
+    return EXIT_OK
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Back up a notes folder to a git remote. Run without arguments for the GUI.")
+    subparsers = parser.add_subparsers(dest='command')
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--notes', required=True, help="Folder to back up")
+    common.add_argument('--repo', required=True, help="Repository URL (SSH or HTTPS)")
+    common.add_argument('--branch', default='main')
+    common.add_argument('--ssh-key', help="Private key for SSH remotes")
+    common.add_argument('--username', help="Username for HTTPS remotes")
+    common.add_argument('--password', default=os.environ.get('GIT_BACKUP_PASSWORD'),
+                        help="Password or token for HTTPS remotes (default: $GIT_BACKUP_PASSWORD)")
+    common.add_argument('--content-hash', action='store_true', help="Detect changes by file content")
+    common.add_argument('--copy-workers', type=int, default=8)
+    common.add_argument('--copy-mode', choices=COPY_MODES, default='copy')
+    common.add_argument('--direct-staging', action='store_true',
+                        help="Stage straight from the notes folder instead of a mirror copy")
+    common.add_argument('--chunk-threshold', type=int, metavar='MIB',
+                        help="Store files of at least this many MiB as deduplicated chunks")
+    common.add_argument('--report-log', metavar='FILE', help="Append a JSON line with phase timings per run")
+    common.add_argument('--metrics-file', metavar='FILE',
+                        help="Write Prometheus metrics for the node_exporter textfile collector")
+    common.add_argument('--submodule', dest='submodules', action='append', default=[], metavar='PATH',
+                        help="Nested repository in the notes folder to back up as a submodule (repeatable)")
+    common.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                        help="Gitignore-style pattern to skip (repeatable)")
+    common.add_argument('--full-clone', dest='partial_clone', action='store_false',
+                        help="Download all file contents when starting a new mirror from the remote")
+    common.add_argument('--push-interval', type=float, metavar='SECONDS',
+                        help="Commit every run but push only once the oldest unpushed commit is this old")
+    common.add_argument('--push-commits', type=int, metavar='N', help="... or once N commits are unpushed")
+    common.add_argument('--push-bytes', type=int, metavar='MIB', help="... or once MIB of changes are unpushed")
+    common.add_argument('--no-performance-profile', dest='performance_profile', action='store_false',
+                        help="Leave the backup repository's index format and caches at git's defaults")
+    common.add_argument('--no-ssh-multiplex', dest='ssh_multiplex', action='store_false',
+                        help="Open a fresh SSH connection for every remote operation")
+    common.add_argument('--json', action='store_true', help="Print a JSON summary on stdout")
+    common.add_argument('--quiet', action='store_true', help="Only log warnings and errors")
+
+    backup_parser = subparsers.add_parser('backup', parents=[common], help="Run one backup")
+    backup_parser.add_argument('--force', action='store_true', help="Commit even without changes")
+    watch_parser = subparsers.add_parser('watch', parents=[common], help="Back up continuously on changes")
+    watch_parser.add_argument('--debounce', type=float, default=2.0)
+    watch_parser.add_argument('--poll-interval', type=float, default=2.0)
+    subparsers.add_parser('status', parents=[common], help="Show the state of the backup repository")
+    subparsers.add_parser('flush', parents=[common], help="Push the commits held back by the push policy")
+    maintain_parser = subparsers.add_parser('maintain', parents=[common],
+                                            help="Repack the backup repository if it has grown (for idle-time cron jobs)")
+    maintain_parser.add_argument('--force', action='store_true', help="Run even if no threshold is reached")
+    subparsers.add_parser('dry-run', parents=[common], help="List what the next backup would change")
+    restore_parser = subparsers.add_parser('restore', parents=[common],
+                                           help="Copy a file out of the backup, reassembling chunked files")
+    restore_parser.add_argument('--path', required=True, help="File to restore, relative to the notes folder")
+    restore_parser.add_argument('--output', required=True, help="Where to write the restored file")
+
+    schedule_parser = subparsers.add_parser('schedule', help="Back up several folders concurrently")
+    schedule_parser.add_argument('--jobs', required=True,
+                                 help="JSON file with a list of jobs (SSHGitBackup keyword arguments)")
+    schedule_parser.add_argument('--workers', type=int, default=4)
+    schedule_parser.add_argument('--per-remote', type=int, default=2,
+                                 help="Concurrent network operations per remote host")
+    schedule_parser.add_argument('--json', action='store_true', help="Print a JSON summary on stdout")
+    schedule_parser.add_argument('--quiet', action='store_true', help="Only log warnings and errors")
+    return parser
+
+
+@contextlib.contextmanager
+def _stdout_to_stderr():
+    """Send everything written to fd 1 (including git's output) to stderr."""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(2, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def _emit(args, payload):
+    if args.json:
+        print(json.dumps(payload, default=str))
+    else:
+        for key, value in payload.items():
+            print(f"{key}: {value}")
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        return run_gui()
+
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO,
+                        format='%(asctime)s - %(levelname)s: %(message)s')
+    if args.command == 'schedule':
+        return run_schedule(args)
+
+    try:
+        backup = SSHGitBackup(args.notes, args.repo, ssh_key_path=args.ssh_key, branch=args.branch,
+                              username=args.username, password=args.password,
+                              content_hash=args.content_hash, copy_workers=args.copy_workers,
+                              copy_mode=args.copy_mode, direct_staging=args.direct_staging,
+                              ssh_multiplex=args.ssh_multiplex, exclude=args.exclude,
+                              report_log=args.report_log, metrics_file=args.metrics_file,
+                              submodules=args.submodules, partial_clone=args.partial_clone,
+                              push_interval=args.push_interval, push_commits=args.push_commits,
+                              push_bytes=args.push_bytes * 1024 * 1024 if args.push_bytes else None,
+                              performance_profile=args.performance_profile,
+                              chunk_threshold=args.chunk_threshold * 1024 * 1024 if args.chunk_threshold else None)
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_USAGE
+
+    if args.command == 'status':
+        _emit(args, backup.status())
+        return EXIT_OK
+
+    if args.command == 'dry-run':
+        try:
+            changes = []
+            with _stdout_to_stderr():
+                counts = backup.dry_run(on_change=lambda rel_path, status: changes.append((rel_path, status)))
+        except Exception as e:
+            _emit(args, {'ok': False, 'error': str(e)})
+            return EXIT_FAILED
+        if args.json:
+            _emit(args, {'ok': True, **counts, 'changes': dict(changes)})
+        else:
+            for rel_path, status in changes:
+                print(f"{status}: {rel_path}")
+        return EXIT_OK
+
+    if args.command == 'flush':
+        with _stdout_to_stderr():
+            ok = backup.flush()
+        _emit(args, {'ok': ok, 'pending_push': backup.pending_push})
+        return EXIT_OK if ok else EXIT_FAILED
+
+    if args.command == 'maintain':
+        with _stdout_to_stderr():
+            record = backup.maintain(force=args.force)
+        _emit(args, {'ok': record is not False, 'ran': bool(record), **(record or {})})
+        return EXIT_FAILED if record is False else EXIT_OK
+
+    if args.command == 'restore':
+        try:
+            backup.restore(args.path, args.output)
+        except (OSError, ValueError) as e:
+            _emit(args, {'ok': False, 'error': str(e)})
+            return EXIT_FAILED
+        _emit(args, {'ok': True, 'path': args.path, 'output': args.output})
+        return EXIT_OK
+
+    if args.command == 'watch':
+        stop_event = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop_event.set())
+        with _stdout_to_stderr():
+            result = backup.watch(debounce=args.debounce, poll_interval=args.poll_interval, stop_event=stop_event)
+        _emit(args, {**result, 'pending_push': backup.pending_push})
+        return EXIT_OK if result['ok'] else EXIT_FAILED
+
+    started = time.monotonic()
+    with _stdout_to_stderr():
+        ok = backup.backup(force=args.force)
+        backup.stop_fsmonitor()  # git status starts it; it would outlive this one-off run
+    _emit(args, {'ok': ok, **backup.summary(), 'fast_path': backup.fast_path_taken,
+                 'pending_push': backup.pending_push, 'duration': round(time.monotonic() - started, 3),
+                 'phases': backup.report.to_dict()['phases']})
+    return EXIT_OK if ok else EXIT_FAILED
+
+
+def run_schedule(args):
+    try:
+        with open(args.jobs, 'r', encoding='utf-8') as f:
+            jobs = [SSHGitBackup(**job) for job in json.load(f)]
+        scheduler = BackupScheduler(jobs, max_workers=args.workers, per_remote_limit=args.per_remote)
+    except (OSError, ValueError, TypeError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_USAGE
+
+    started = time.monotonic()
+    with _stdout_to_stderr():
+        results = scheduler.run()
+        for job in jobs:
+            job.stop_fsmonitor()
+    ok = all(results.values())
+    _emit(args, {'ok': ok, 'jobs': results, 'duration': round(time.monotonic() - started, 3)})
+    return EXIT_OK if ok else EXIT_FAILED
+
+
+# Running the application
+if __name__ == "__main__":
+    sys.exit(main())
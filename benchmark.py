@@ -0,0 +1,247 @@
+"""Benchmarks for SSHGitBackup against a local bare repository.
+
+Each scenario generates a synthetic notes tree, then times a cold backup (fresh
+mirror and remote), warm backups after a churn pattern, and no-op backups. Every
+scenario runs in its own subprocess so its peak RSS can be reported.
+
+    python benchmark.py                      # all scenarios
+    python benchmark.py small-files --runs 10 --json
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import subprocess
+import shutil
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def list_files(root):
+    return sorted(os.path.relpath(os.path.join(dirpath, name), root)
+                  for dirpath, _, names in os.walk(root) for name in names)
+
+
+def edit_some(root, rng, count):
+    """Append a line to count random files."""
+    files = list_files(root)
+    for rel_path in rng.sample(files, min(count, len(files))):
+        with open(os.path.join(root, rel_path), 'ab') as f:
+            f.write(b'edited %d\n' % rng.getrandbits(32))
+
+
+def build_small_files(root, rng, scale):
+    for i in range(int(2000 * scale)):
+        write_file(os.path.join(root, f'topic{i % 50:02d}', f'note{i:05d}.md'),
+                   rng.randbytes(rng.randint(200, 4000)))
+
+
+def churn_small_files(root, rng, scale):
+    edit_some(root, rng, max(1, int(10 * scale)))
+
+
+def build_huge_files(root, rng, scale):
+    for i in range(4):
+        write_file(os.path.join(root, 'media', f'recording{i}.bin'), rng.randbytes(int(32 * 1024 * 1024 * scale)))
+    write_file(os.path.join(root, 'index.md'), b'# Media\n')
+
+
+def churn_huge_files(root, rng, scale):
+    path = os.path.join(root, 'media', f'recording{rng.randrange(4)}.bin')
+    with open(path, 'r+b') as f:
+        f.seek(rng.randrange(os.path.getsize(path)))
+        f.write(rng.randbytes(4096))
+
+
+def build_deep_nesting(root, rng, scale):
+    for branch in range(max(1, int(20 * scale))):
+        path = os.path.join(root, f'branch{branch:02d}')
+        for depth in range(40):
+            path = os.path.join(path, f'level{depth:02d}')
+            write_file(os.path.join(path, 'note.md'), rng.randbytes(500))
+
+
+def churn_deep_nesting(root, rng, scale):
+    edit_some(root, rng, 5)
+
+
+def build_flat(root, rng, scale):
+    for i in range(int(1000 * scale)):
+        write_file(os.path.join(root, f'inbox{i % 10}', f'note{i:05d}.md'), rng.randbytes(2000))
+
+
+def churn_rename_storm(root, rng, scale):
+    files = list_files(root)
+    for rel_path in rng.sample(files, max(1, len(files) // 10)):
+        target = os.path.join(root, f'archive{rng.randrange(10)}', f'{rng.getrandbits(40):010x}.md')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.rename(os.path.join(root, rel_path), target)
+
+
+def churn_touch_only(root, rng, scale):
+    files = list_files(root)
+    now = time.time()
+    for rel_path in rng.sample(files, max(1, len(files) // 4)):
+        os.utime(os.path.join(root, rel_path), (now, now + rng.random()))
+
+
+# name -> (tree builder, churn applied before every warm run)
+SCENARIOS = {
+    'small-files': (build_small_files, churn_small_files),  # Many small notes in a shallow tree
+    'huge-files': (build_huge_files, churn_huge_files),  # A few large binaries, one patched per run
+    'deep-nesting': (build_deep_nesting, churn_deep_nesting),  # Long directory chains
+    'rename-storm': (build_flat, churn_rename_storm),  # A tenth of the files moved per run
+    'touch-only': (build_flat, churn_touch_only),  # New mtimes, identical content
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * pct // 100) - 1)]
+
+
+def tree_size(root):
+    return sum(os.path.getsize(os.path.join(root, rel_path)) for rel_path in list_files(root))
+
+
+def run_scenario(name, args):
+    """Run one scenario in this process and return its results."""
+    from auto_git_gui import SSHGitBackup
+
+    build, churn = SCENARIOS[name]
+    rng = random.Random(args.seed)
+    base = tempfile.mkdtemp(prefix=f'gms-bench-{name}-')
+    try:
+        notes = os.path.join(base, 'notes')
+        remote = os.path.join(base, 'remote.git')
+        os.makedirs(notes)
+        subprocess.run(['git', 'init', '-q', '--bare', remote], check=True)
+        build(notes, rng, args.scale)
+        files, size = len(list_files(notes)), tree_size(notes)
+
+        backup = SSHGitBackup(notes, remote, branch='main', mirror_dir=os.path.join(base, 'mirror'),
+                              copy_mode=args.copy_mode, content_hash=args.content_hash,
+                              direct_staging=args.direct_staging, ssh_multiplex=False,
+                              performance_profile=args.performance_profile)
+
+        def timed_backup():
+            started = time.perf_counter()
+            if not backup.backup():
+                raise RuntimeError(f"{name}: backup failed")
+            return time.perf_counter() - started, backup.report.to_dict()['phases']
+
+        cold, cold_phases = timed_backup()
+        warm, noop = [], []
+        for _ in range(args.runs):
+            churn(notes, rng, args.scale)
+            warm.append(timed_backup()[0])
+        for _ in range(args.runs):
+            noop.append(timed_backup()[0])
+        backup.stop_fsmonitor()
+
+        peak_rss = None
+        if resource is not None:
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak_rss *= 1 if sys.platform == 'darwin' else 1024  # Linux reports KiB
+        return {
+            'scenario': name,
+            'files': files,
+            'bytes': size,
+            'cold_seconds': round(cold, 4),
+            'cold_files_per_second': round(files / cold, 1),
+            'cold_mb_per_second': round(size / cold / 1e6, 2),
+            'cold_phases': {phase: stats['seconds'] for phase, stats in cold_phases.items()},
+            'warm_p50': round(percentile(warm, 50), 4),
+            'warm_p95': round(percentile(warm, 95), 4),
+            'noop_p50': round(percentile(noop, 50), 4),
+            'noop_p95': round(percentile(noop, 95), 4),
+            'peak_rss_mb': round(peak_rss / 1e6, 1) if peak_rss else None,
+        }
+    finally:
+        if args.keep:
+            print(f"kept {base}", file=sys.stderr)
+        else:
+            shutil.rmtree(base, ignore_errors=True)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark backups against a local bare repository.")
+    parser.add_argument('scenarios', nargs='*', metavar='SCENARIO',
+                        help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument('--runs', type=int, default=5, help="Warm and no-op runs per scenario")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiply the size of every tree")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--copy-mode', default='copy')
+    parser.add_argument('--content-hash', action='store_true')
+    parser.add_argument('--direct-staging', action='store_true')
+    parser.add_argument('--no-performance-profile', dest='performance_profile', action='store_false',
+                        help="Measure the mirror with git's default index format and caches")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated trees and repositories")
+    parser.add_argument('--json', action='store_true', help="Print one JSON object per scenario")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    return parser
+
+
+def child_command(name, args):
+    command = [sys.executable, os.path.abspath(__file__), name, '--child', '--runs', str(args.runs),
+               '--scale', str(args.scale), '--seed', str(args.seed), '--copy-mode', args.copy_mode]
+    for flag in ('content_hash', 'direct_staging', 'keep'):
+        if getattr(args, flag):
+            command.append('--' + flag.replace('_', '-'))
+    if not args.performance_profile:
+        command.append('--no-performance-profile')
+    return command
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+    if args.child:
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(run_scenario(args.scenarios[0], args)))
+        return 0
+
+    env = dict(os.environ, GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@localhost',
+               GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@localhost')
+    failed = False
+    for name in args.scenarios or list(SCENARIOS):
+        # A fresh interpreter per scenario, so peak RSS is not carried over
+        child = subprocess.run(child_command(name, args), capture_output=True, text=True, env=env)
+        if child.returncode != 0:
+            failed = True
+            print(f"{name}: failed\n{child.stderr.strip()}", file=sys.stderr)
+            continue
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"{name:13} {result['files']:6d} files {result['bytes'] / 1e6:8.1f} MB | "
+                  f"cold {result['cold_seconds']:7.3f}s ({result['cold_files_per_second']:.0f} files/s, "
+                  f"{result['cold_mb_per_second']:.1f} MB/s) | "
+                  f"warm p50 {result['warm_p50']:.3f}s p95 {result['warm_p95']:.3f}s | "
+                  f"no-op p50 {result['noop_p50']:.3f}s p95 {result['noop_p95']:.3f}s | "
+                  f"peak RSS {result['peak_rss_mb']} MB")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+import os
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+from auto_git_gui import SSHGitBackup
+
+
+def run_git(*args, cwd=None):
+    return subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True, text=True).stdout
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+@pytest.fixture(autouse=True)
+def git_identity(monkeypatch, tmp_path):
+    """Keep git and the credential files away from the real home directory."""
+    monkeypatch.setenv('HOME', str(tmp_path))
+    for name in ('AUTHOR', 'COMMITTER'):
+        monkeypatch.setenv(f'GIT_{name}_NAME', 'test')
+        monkeypatch.setenv(f'GIT_{name}_EMAIL', 'test@localhost')
+
+
+@pytest.fixture
+def git():
+    return run_git
+
+
+@pytest.fixture
+def write():
+    return write_file
+
+
+@pytest.fixture
+def repos(tmp_path):
+    """A notes folder, the path for its mirror and an empty bare remote."""
+    repos = SimpleNamespace(notes=str(tmp_path / 'notes'), mirror=str(tmp_path / 'mirror'),
+                            remote=str(tmp_path / 'remote.git'))
+    os.makedirs(repos.notes)
+    run_git('init', '-q', '--bare', '-b', 'main', repos.remote)
+    return repos
+
+
+@pytest.fixture
+def make_backup(repos):
+    """Build an SSHGitBackup of repos.notes into repos.mirror, without SSH or the performance profile."""
+    def make(repo_url=None, **options):
+        options = {'mirror_dir': repos.mirror, 'ssh_multiplex': False, 'performance_profile': False, **options}
+        return SSHGitBackup(repos.notes, repo_url or repos.remote, **options)
+    return make
@@ -0,0 +1,70 @@
+import os
+import shutil
+
+from auto_git_gui import DEFAULT_IGNORE_PATTERNS, IgnoreRules, scan_tree
+
+# What the original _create_gitignore wrote: indented patterns, which git never matched
+LEGACY_GITIGNORE = '.*\n' + '\n'.join('        ' + pattern for pattern in DEFAULT_IGNORE_PATTERNS[1:])
+
+
+def test_tracked_files_are_never_ignored():
+    rules = IgnoreRules(['*.bak', 'node_modules/'], keep=['a/thesis.bak', 'web/node_modules/pkg/index.js'])
+    assert not rules.matches('a/thesis.bak', False)
+    assert rules.matches('a/other.bak', False)
+    assert not rules.matches('web/node_modules', True)
+    assert not rules.matches('web/node_modules/pkg', True)
+    assert not rules.matches('web/node_modules/pkg/index.js', False)
+    # Entered only for the tracked file; everything else in there stays ignored
+    assert rules.matches('web/node_modules/pkg/other.js', False)
+    assert rules.matches('web/node_modules/left-pad', True)
+    assert rules.excluded('web/node_modules/left-pad/index.js', False)
+
+
+def test_scan_tree_descends_into_ignored_directories_for_tracked_files(tmp_path, write):
+    for rel_path in ('node_modules/pkg/index.js', 'node_modules/pkg/other.js', 'notes.md'):
+        write(os.path.join(tmp_path, rel_path), 'x')
+    rules = IgnoreRules(['node_modules/'], keep=['node_modules/pkg/index.js'])
+    assert [rel_path for rel_path, _ in scan_tree(str(tmp_path), rules)] == \
+        ['node_modules/pkg/index.js', 'notes.md']
+
+
+def test_repairing_legacy_gitignore_keeps_tracked_files(repos, make_backup, git, write):
+    notes, mirror, remote = repos.notes, repos.mirror, repos.remote
+    write(os.path.join(notes, 'a', 'note.md'), 'draft\n')
+    write(os.path.join(notes, 'a', 'thesis.bak'), 'the only copy\n')
+
+    # A mirror made by the original version: broken .gitignore, *.bak tracked, no manifest
+    shutil.copytree(notes, mirror)
+    write(os.path.join(mirror, '.gitignore'), LEGACY_GITIGNORE)
+    git('init', '-q', '-b', 'main', cwd=mirror)
+    git('add', '-A', cwd=mirror)
+    git('commit', '-q', '-m', 'Backup', cwd=mirror)
+    git('remote', 'add', 'origin', remote, cwd=mirror)
+    git('push', '-q', 'origin', 'main', cwd=mirror)
+
+    write(os.path.join(notes, 'a', 'note.md'), 'final draft\n')
+    backup = make_backup()
+    assert backup.backup()
+
+    tracked = git('--git-dir', remote, 'ls-tree', '-r', '--name-only', 'main').split()
+    assert 'a/thesis.bak' in tracked
+    assert backup.sync_counts['deleted'] == 0
+    with open(os.path.join(mirror, '.gitignore')) as f:
+        assert f.read().splitlines() == list(DEFAULT_IGNORE_PATTERNS)
+
+    # Deleted at the source: gone from the backup, and no longer exempt from the rules
+    os.remove(os.path.join(notes, 'a', 'thesis.bak'))
+    assert backup.backup()
+    assert 'a/thesis.bak' not in git('--git-dir', remote, 'ls-tree', '-r', '--name-only', 'main').split()
+    assert not backup._ignore_rules().keep
+
+
+def test_no_op_backup_after_a_commit_spawns_no_git(repos, make_backup, write):
+    write(os.path.join(repos.notes, 'a', 'note.md'), 'draft\n')
+    backup = make_backup()
+    assert backup.backup()
+
+    write(os.path.join(repos.notes, 'a', 'note.md'), 'final draft\n')
+    assert backup.backup() and backup.sync_counts['updated'] == 1
+    assert backup.backup() and backup.fast_path_taken
+    assert backup.git_calls == []
@@ -0,0 +1,147 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import auto_git_gui
+from auto_git_gui import SSHGitBackup, SyncJournal
+
+# Runs a backup in a child process that dies (as on a power cut) on the given copy
+CRASHING_BACKUP = """
+import os, sys
+import auto_git_gui
+notes, remote, mirror, crash_at = sys.argv[1:]
+copies = []
+copy_file = auto_git_gui.SSHGitBackup._copy_file
+def crashing_copy(self, src_file, dest_file):
+    copies.append(src_file)
+    if len(copies) == int(crash_at):
+        os._exit(1)
+    copy_file(self, src_file, dest_file)
+auto_git_gui.SSHGitBackup._copy_file = crashing_copy
+auto_git_gui.SSHGitBackup(notes, remote, mirror_dir=mirror, copy_workers=1, ssh_multiplex=False,
+                          performance_profile=False).backup()
+"""
+
+
+def crash_backup(repos, crash_at):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(auto_git_gui.__file__)))
+    result = subprocess.run([sys.executable, '-c', CRASHING_BACKUP, repos.notes, repos.remote, repos.mirror,
+                             str(crash_at)], env=env, capture_output=True, text=True)
+    assert result.returncode == 1, result.stderr
+
+
+def journaled_copies(mirror):
+    with open(os.path.join(mirror, '.git', 'backup', 'journal.jsonl')) as f:
+        return {line[1] for line in map(json.loads, f) if line[0] == 'done'}
+
+
+def resume_backup(monkeypatch, repos, make_backup):
+    """Run the backup after a crash; returns the files it copied."""
+    copied = []
+    copy_file = SSHGitBackup._copy_file
+    monkeypatch.setattr(SSHGitBackup, '_copy_file', lambda self, src_file, dest_file: (
+        copied.append(os.path.relpath(src_file, repos.notes)), copy_file(self, src_file, dest_file)))
+    assert make_backup(copy_workers=1).backup()
+    assert not os.path.exists(os.path.join(repos.mirror, '.git', 'backup', 'journal.jsonl'))
+    assert tree(repos.mirror) == tree(repos.notes)
+    return copied
+
+
+def tree(root):
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+        for name in filenames:
+            if not name.startswith('.'):
+                path = os.path.join(dirpath, name)
+                with open(path) as f:
+                    files[os.path.relpath(path, root)] = f.read()
+    return files
+
+
+def test_journal_merges_the_runs_of_a_sync(tmp_path):
+    journal = SyncJournal(str(tmp_path / 'journal.jsonl')).open()
+    journal.done('b.md', (1, 2, 3, None))
+    journal.deleted('d.md')
+    journal.start_run()  # Moves settled after the walk, earlier in path order
+    journal.deleted('a.md')
+    journal.planned('c.md')
+    journal.done('c.md', (4, 5, 6, None))
+    journal.close()
+    assert [(rel_path, op) for rel_path, (op, _) in journal.completed()] == \
+        [('a.md', 'deleted'), ('b.md', 'done'), ('c.md', 'done'), ('d.md', 'deleted')]
+
+
+@pytest.mark.parametrize('limit', [1, auto_git_gui.MOVE_DETECTION_LIMIT])
+def test_moves_beyond_the_detection_limit_are_copied_instead(monkeypatch, repos, make_backup, write, limit):
+    monkeypatch.setattr(auto_git_gui, 'MOVE_DETECTION_LIMIT', limit)
+    for i in range(4):
+        write(os.path.join(repos.notes, 'old', f'{i}.md'), f'note {i}\n')
+    backup = make_backup()
+    assert backup.backup()
+
+    os.rename(os.path.join(repos.notes, 'old'), os.path.join(repos.notes, 'new'))
+    assert backup.backup()
+    assert tree(repos.mirror) == tree(repos.notes)
+    assert backup.sync_counts['renamed'] == min(limit, 4)  # Only the held-back pair is followed
+    assert not os.path.exists(os.path.join(repos.mirror, '.git', 'backup', 'journal.jsonl'))
+
+
+def test_change_summary_leaves_out_unknown_sizes(repos, make_backup, write):
+    for name in ('a.md', 'b.md', 'c.md'):
+        write(os.path.join(repos.notes, name), 'note\n')
+    backup = make_backup()
+    assert backup.backup()
+
+    # Without a manifest the mirror is compared by path only, so deleted sizes are unknown
+    os.remove(os.path.join(repos.mirror, '.git', 'backup', 'manifest.jsonl'))
+    os.remove(os.path.join(repos.notes, 'a.md'))
+    os.remove(os.path.join(repos.notes, 'b.md'))
+    write(os.path.join(repos.notes, 'c.md'), 'longer note\n')
+    assert backup.backup()
+    assert backup.change_summary()[:2] == ['Files updated: 1 (12 B)', 'Files deleted: 2']
+
+
+def test_sync_with_new_files_resumes_after_a_crash(monkeypatch, repos, make_backup, write):
+    write(os.path.join(repos.notes, 'a.md'), 'note\n')
+    assert make_backup().backup()
+
+    # New files are settled after the walk, in the journal's second run
+    for i in range(200):
+        write(os.path.join(repos.notes, 'new', f'{i:03}.md'), f'note {i}\n')
+    crash_backup(repos, 50)
+    done = journaled_copies(repos.mirror)
+    assert 0 < len(done) < 50
+
+    copied = resume_backup(monkeypatch, repos, make_backup)
+    assert len(copied) == 200 - len(done) and not done & set(copied)
+
+
+def test_sync_resumes_after_a_crash_without_copying_finished_files(monkeypatch, repos, make_backup, write):
+    for i in range(100):
+        write(os.path.join(repos.notes, f'{i:03}.md'), f'note {i}\n')
+    assert make_backup().backup()
+
+    for i in range(100):
+        write(os.path.join(repos.notes, f'{i:03}.md'), f'edited note {i}\n')
+    crash_backup(repos, 30)
+    done = journaled_copies(repos.mirror)
+    assert 0 < len(done) < 30
+
+    copied = resume_backup(monkeypatch, repos, make_backup)
+    assert len(copied) == 100 - len(done) and not done & set(copied)
+
+
+def test_direct_staging_reports_renames_in_a_new_history(repos, make_backup, write):
+    for i in range(3):
+        write(os.path.join(repos.notes, 'old', f'{i}.md'), f'note {i}\n')
+    backup = make_backup(direct_staging=True)
+    assert backup.backup()
+
+    # The remote had no branch, so the mirror holds every blob and git may detect renames
+    os.rename(os.path.join(repos.notes, 'old'), os.path.join(repos.notes, 'new'))
+    assert backup.backup()
+    assert backup.sync_counts['renamed'] == 3 and backup.sync_counts['deleted'] == 0